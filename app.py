@@ -1,74 +1,130 @@
 import gradio as gr
-from essay_writer import create_essay_chain
+from essay_writer import get_essay_chain, astream_essay
 from chat_db import ChatDatabase
+from metrics import registry as metrics
+from metrics_store import MetricsStore
+import asyncio
+import atexit
 import json
+import os
 import uuid
-from typing import Dict, List, Tuple
+from typing import AsyncIterator, Dict, List
 
-db = ChatDatabase()
+CHAT_DB_PATH = os.environ.get("CHAT_DB_PATH", "chat_history.db")
+METRICS_DB_PATH = os.environ.get("METRICS_DB_PATH", "metrics.db")
 
-def format_conversation_history(conversations: List[Tuple]) -> str:
-    if not conversations:
+# Conversations are written by a background thread in batches; close()
+# drains the queue on shutdown
+db = ChatDatabase(
+    CHAT_DB_PATH,
+    write_behind=True,
+    compact=os.environ.get("CHAT_DB_COMPACT") == "1"
+)
+atexit.register(db.close)
+
+# Per-node metrics are persisted to metrics.db; summarize them with
+# `python metrics.py`
+metrics_store = MetricsStore(METRICS_DB_PATH)
+metrics.sink = metrics_store.record
+atexit.register(metrics_store.close)
+atexit.register(metrics.flush)
+
+# Streams the events of one essay run. Runs the graph in this process by
+# default; serving.py swaps in its pool of worker processes.
+essay_source = astream_essay
+
+def format_conversation_history(summaries: List[Dict]) -> str:
+    if not summaries:
         return "No previous conversations found."
     
     history = "Previous Conversations:\n\n"
-    for conv in conversations:
-        history += f"• {conv[-1]}\n"  # conv[-1] contains the summary
+    for summary in summaries:
+        history += f"• {summary['summary']}\n"
     return history
 
-def process_request(message: str, history: List[List[str]], user_id: str = None) -> Tuple[str, Dict]:
+STAGE_LABELS = {
+    "planner": "🗺️ Outline ready",
+    "researcher_plan": "🔎 Research gathered",
+    "writer": "✍️ Draft {revision} written",
+    "reflection": "🧐 Critique ready",
+    "researcher_critique": "🔎 Follow-up research gathered",
+}
+
+def format_response(result: Dict, history_text: str) -> str:
+    return f"""📝 Here's your essay:
+
+{result['draft']}
+
+✍️ Writing Process:
+1. Plan: {result['plan']}
+2. Critique: {result['critique']}
+
+📚 {history_text}"""
+
+def format_progress(stages: List[str], draft: str) -> str:
+    progress = "\n".join(stages) or "⏳ Planning your essay..."
+    if draft:
+        return f"{progress}\n\n📝 Writing...\n\n{draft}"
+    return progress
+
+async def process_request(message: str, history: List[List[str]], user_id: str = None) -> AsyncIterator[str]:
     if not user_id:
         user_id = str(uuid.uuid4())
-        db.create_or_get_user(user_id, f"user_{user_id[:8]}")
-    
-    # Get user's conversation history
-    recent_conversations = db.get_recent_conversations(user_id)
-    last_summary = db.get_last_conversation_summary(user_id)
+    await asyncio.to_thread(db.create_or_get_user, user_id, f"user_{user_id[:8]}")
     
-    # Initialize the essay chain
-    chain = create_essay_chain()
+    # Get user's recent summaries, usually from the in-process cache (SQLite
+    # calls stay off the event loop)
+    summaries = await asyncio.to_thread(db.get_recent_summaries, user_id)
     
     # Add context from last conversation if available
     context = ""
-    if last_summary:
-        context = f"\nContext from last conversation - Topic: {last_summary['task']}\n"
+    if summaries:
+        context = f"\nContext from last conversation - Topic: {summaries[0]['task']}\n"
     
-    # Process the request
-    result = chain.invoke({
+    # Stream stage events and writer tokens while the graph runs
+    stages, draft, result = [], "", None
+    yield format_progress(stages, draft)
+    async for event in essay_source({
         "task": message + context,
         "content": [],
         "max_revisions": 1,
         "revision_number": 0
-    })
+    }):
+        kind = event[0]
+        if kind == "node":
+            _, node, update = event
+            stages.append(STAGE_LABELS.get(node, node).format(
+                revision=(update or {}).get("revision_number", "")))
+            # A finished draft is replaced by the next revision's tokens
+            draft = ""
+        elif kind == "token":
+            draft += event[1]
+        else:
+            result = event[1]
+            continue
+        yield format_progress(stages, draft)
     
     # Save to database
-    db.save_conversation(user_id, result)
+    db.enqueue_conversation(user_id, result)
+    await asyncio.to_thread(metrics.flush)
     
     # Format conversation history
-    history_text = format_conversation_history(recent_conversations)
+    history_text = format_conversation_history(summaries)
     
-    # Format response
-    response = f"""📝 Here's your essay:
-
-{result['draft']}
-
-✍️ Writing Process:
-1. Plan: {result['plan']}
-2. Critique: {result['critique']}
-
-📚 {history_text}"""
-    
-    return response
+    yield format_response(result, history_text)
 
 def create_interface():
     with gr.Blocks(theme=gr.themes.Soft()) as demo:
-        user_id = gr.State(lambda: str(uuid.uuid4()))
-        
         gr.Markdown("# AI Essay Writer & Assistant")
         gr.Markdown("I can help you write essays on any topic. Your conversation history will be preserved!")
         
+        async def respond(msg, history, request: gr.Request):
+            # Each browser session is its own user
+            async for partial in process_request(msg, history, request.session_hash if request else None):
+                yield partial
+
         chatbot = gr.ChatInterface(
-            fn=lambda msg, history: process_request(msg, history, user_id.value),
+            fn=respond,
             examples=[
                 "Write an essay about climate change",
                 "Write a persuasive essay about the importance of education",
@@ -80,5 +136,7 @@ def create_interface():
     return demo
 
 if __name__ == "__main__":
+    # Warm start: compile the graph before the first request arrives
+    get_essay_chain()
     demo = create_interface()
     demo.launch(share=True)
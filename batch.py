@@ -0,0 +1,168 @@
+import argparse
+import csv
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Tuple
+
+import essay_writer
+from chat_db import ChatDatabase, WriteBehindError
+from scheduler import BATCH, priority
+from search_cache import SearchCache
+
+logger = logging.getLogger(__name__)
+
+
+def read_tasks(path: str) -> List[Tuple[str, str]]:
+    # (item_key, task) pairs from a JSONL file (objects with "task" and an
+    # optional "id", or bare strings) or a CSV file with a "task" column.
+    # Items without an id are keyed by their position in the file.
+    tasks = []
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            for index, row in enumerate(csv.DictReader(f)):
+                tasks.append((str(row.get("id") or index), row["task"]))
+        return tasks
+
+    with open(path, encoding="utf-8") as f:
+        for index, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                tasks.append((str(index), item))
+            else:
+                tasks.append((str(item.get("id", index)), item["task"]))
+    return tasks
+
+
+class SharedSearchClient:
+    # Wraps a search client so identical queries across the batch, including
+    # ones in flight at the same time, reach the backend once
+    def __init__(self, client):
+        self.client = client
+        self.requests = 0
+        self.backend_calls = 0
+        self._results: Dict[Tuple[str, int], Dict] = {}
+        self._inflight: Dict[Tuple[str, int], threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def search(self, query: str, max_results: int = 5, **kwargs) -> Dict:
+        key = (SearchCache.normalize(query), max_results)
+        with self._lock:
+            self.requests += 1
+        while True:
+            with self._lock:
+                if key in self._results:
+                    return self._results[key]
+                event = self._inflight.get(key)
+                if event is None:
+                    event = self._inflight[key] = threading.Event()
+                    self.backend_calls += 1
+                    break
+            # Another worker is fetching it; wait and look again
+            event.wait()
+
+        try:
+            response = self.client.search(query=query, max_results=max_results, **kwargs)
+            with self._lock:
+                self._results[key] = response
+            return response
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            event.set()
+
+
+def run_batch(tasks: List[Tuple[str, str]], db: ChatDatabase, batch_id: str, user_id: str = "batch",
+              workers: int = 4, max_revisions: int = 1) -> Dict:
+    db.create_or_get_user(user_id, user_id)
+    completed = db.get_completed_batch_items(batch_id)
+    pending = [(key, task) for key, task in tasks if key not in completed]
+    logger.info("Batch %s: %d tasks, %d already done, %d to run",
+                batch_id, len(tasks), len(tasks) - len(pending), len(pending))
+
+    search = SharedSearchClient(essay_writer.search_client.get())
+
+    def run_one(key: str, task: str):
+        # With a persistent checkpointer an item that failed part-way resumes
+        # from its last checkpoint. Batch calls leave rate-limit headroom for
+        # interactive users.
+        with priority(BATCH):
+            state = essay_writer.invoke_essay({
+                "task": task,
+                "content": [],
+                "max_revisions": max_revisions,
+                "revision_number": 0
+            }, thread_id=f"batch:{batch_id}:{key}", resume=True)
+        # Written in bulk by the write-behind thread, together with the
+        # batch_items marker that lets a rerun skip this item
+        db.enqueue_conversation(user_id, state, (batch_id, key))
+
+    done, failed = 0, 0
+    start = time.perf_counter()
+    with essay_writer.search_client.override(search), ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_one, key, task): key for key, task in pending}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                done += 1
+            except Exception:
+                failed += 1
+                logger.exception("Batch item %s failed", futures[future])
+            if (done + failed) % 10 == 0:
+                logger.info("%d/%d done, %d failed", done + failed, len(pending), failed)
+    try:
+        db.flush()
+    except WriteBehindError as e:
+        # Essays that were generated but never saved count as failed; a
+        # rerun picks them up again
+        lost = len([item for _, _, item in e.items if item and item[0] == batch_id])
+        done -= lost
+        failed += lost
+        logger.error("Batch %s: %d essays could not be saved: %s", batch_id, lost, e)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "batch_id": batch_id,
+        "total": len(tasks),
+        "skipped": len(tasks) - len(pending),
+        "completed": done,
+        "failed": failed,
+        "seconds": elapsed,
+        "essays_per_minute": done / elapsed * 60 if elapsed else 0.0,
+        "search_requests": search.requests,
+        "search_backend_calls": search.backend_calls
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate essays for every task in a JSONL or CSV file")
+    parser.add_argument("tasks", help="JSONL (objects with 'task' and optional 'id') or CSV with a 'task' column")
+    parser.add_argument("--batch-id", help="name used to resume an interrupted run (default: the file name)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-revisions", type=int, default=1)
+    parser.add_argument("--user", default="batch", help="user id the essays are saved under")
+    parser.add_argument("--db", default="chat_history.db")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    db = ChatDatabase(args.db, write_behind=True)
+    try:
+        stats = run_batch(
+            read_tasks(args.tasks), db,
+            batch_id=args.batch_id or args.tasks,
+            user_id=args.user,
+            workers=args.workers,
+            max_revisions=args.max_revisions
+        )
+    finally:
+        db.close()
+
+    print(f"Batch {stats['batch_id']}: {stats['completed']} completed, {stats['failed']} failed, "
+          f"{stats['skipped']} skipped (already done)")
+    print(f"{stats['seconds']:.1f}s, {stats['essays_per_minute']:.1f} essays/min; "
+          f"{stats['search_requests']} searches, {stats['search_backend_calls']} reached the backend")
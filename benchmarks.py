@@ -0,0 +1,415 @@
+import argparse
+import asyncio
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from chat_db import MIGRATIONS, ChatDatabase
+
+# Benchmarks never talk to the real services
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("TAVILY_API_KEY", "benchmark")
+
+
+def report(name: str, timings: list):
+    timings = sorted(timings)
+    mean = sum(timings) / len(timings)
+    p50 = timings[len(timings) // 2]
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f"{name:<44} n={len(timings):<6} mean={mean * 1000:9.3f}ms "
+          f"p50={p50 * 1000:9.3f}ms p95={p95 * 1000:9.3f}ms p99={p99 * 1000:9.3f}ms")
+
+
+def bench_chain(iterations: int = 50):
+    import essay_writer
+
+    # Before: every request rebuilt and recompiled the graph
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        essay_writer.create_essay_chain()
+        timings.append(time.perf_counter() - start)
+    report("create_essay_chain() per request", timings)
+
+    # After: one compile at startup, then a cached lookup per request
+    essay_writer.invalidate_essay_chain()
+    start = time.perf_counter()
+    essay_writer.get_essay_chain()
+    report("get_essay_chain() warm start", [time.perf_counter() - start])
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        essay_writer.get_essay_chain()
+        timings.append(time.perf_counter() - start)
+    report("get_essay_chain() per request", timings)
+
+
+class PerCallChatDatabase(ChatDatabase):
+    # The pre-pooling behaviour: a fresh rollback-journal connection per call
+    def _connect(self):
+        return sqlite3.connect(self.db_path)
+
+
+def sample_state(i: int) -> dict:
+    return {
+        "task": f"Write an essay about topic {i}",
+        "plan": "1. Introduction\n2. Body\n3. Conclusion",
+        "draft": "An essay paragraph. " * 200,
+        "critique": "Add more depth. " * 20,
+        "content": [f"Research snippet {j} for topic {i}. " * 20 for j in range(6)],
+        "revision_number": 2
+    }
+
+
+def run_db_workload(db: ChatDatabase, writers: int, readers: int, ops: int) -> tuple:
+    users = [f"user-{i}" for i in range(max(writers, readers))]
+    for user_id in users:
+        db.create_or_get_user(user_id, user_id)
+    write_timings, read_timings = [], []
+    timings_lock = threading.Lock()
+
+    def writer(n):
+        local = []
+        for i in range(ops):
+            start = time.perf_counter()
+            db.save_conversation(users[n], sample_state(i))
+            local.append(time.perf_counter() - start)
+        with timings_lock:
+            write_timings.extend(local)
+
+    def reader(n):
+        local = []
+        for _ in range(ops):
+            start = time.perf_counter()
+            db.get_recent_conversations(users[n])
+            db.get_last_conversation_summary(users[n])
+            local.append(time.perf_counter() - start)
+        with timings_lock:
+            read_timings.extend(local)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    threads += [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, write_timings, read_timings
+
+
+def bench_db_concurrency(writers: int = 4, readers: int = 4, ops: int = 100):
+    for label, db_class in (("per-call connections", PerCallChatDatabase),
+                            ("thread-local WAL connections", ChatDatabase)):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = db_class(os.path.join(tmp, "chat_history.db"))
+            elapsed, write_timings, read_timings = run_db_workload(db, writers, readers, ops)
+            db.close()
+        total = (writers + readers) * ops
+        print(f"-- {label}: {writers} writers / {readers} readers, "
+              f"{total / elapsed:,.0f} ops/s")
+        report("save_conversation", write_timings)
+        report("history reads", read_timings)
+
+
+def bench_db_write_behind(threads: int = 8, ops: int = 200):
+    for label, options in (("synchronous save_conversation", {}),
+                           ("write-behind enqueue_conversation", {"write_behind": True})):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = ChatDatabase(os.path.join(tmp, "chat_history.db"), **options)
+            db.create_or_get_user("user", "user")
+            timings = []
+            timings_lock = threading.Lock()
+
+            def worker():
+                local = []
+                for i in range(ops):
+                    start = time.perf_counter()
+                    db.enqueue_conversation("user", sample_state(i))
+                    local.append(time.perf_counter() - start)
+                with timings_lock:
+                    timings.extend(local)
+
+            workers = [threading.Thread(target=worker) for _ in range(threads)]
+            start = time.perf_counter()
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            db.flush()
+            elapsed = time.perf_counter() - start
+            db.close()
+        print(f"-- {label}: {threads} threads, {threads * ops / elapsed:,.0f} conversations/s")
+        report("request-path latency", timings)
+
+
+def bench_db_storage(conversations: int = 2000, snippet_pool: int = 300):
+    # Essays on popular topics share most of their research snippets
+    snippets = [f"Snippet {i}: " + "Search result text about a popular topic. " * 25
+                for i in range(snippet_pool)]
+    states = []
+    for i in range(conversations):
+        state = sample_state(i)
+        state["content"] = [snippets[(i * 7 + j) % snippet_pool] for j in range(12)]
+        states.append(state)
+
+    for label, compact in (("plain TEXT columns", False), ("compact storage", True)):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "chat_history.db")
+            db = ChatDatabase(path, compact=compact)
+            db.create_or_get_user("user", "user")
+            start = time.perf_counter()
+            for state in states:
+                db.save_conversation("user", state)
+            write_elapsed = time.perf_counter() - start
+
+            listing = []
+            for _ in range(200):
+                start = time.perf_counter()
+                db.get_recent_conversations("user")
+                listing.append(time.perf_counter() - start)
+
+            conn = db._connect()
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("VACUUM")
+            db.close()
+            size = os.path.getsize(path)
+        print(f"-- {label}: {size / 1024 / 1024:,.2f} MiB for {conversations:,} conversations, "
+              f"{conversations / write_elapsed:,.0f} saves/s")
+        report("get_recent_conversations", listing)
+
+
+def bench_context_budget(revisions: int = 6, budget: int = 3000):
+    from research_context import build_context, estimate_tokens
+
+    # Every research round returns 6 snippets; half repeat earlier results
+    # (sometimes with trivial differences), as repeated searches tend to
+    topics = ["solar power adoption", "carbon emissions policy", "sea level rise",
+              "renewable energy jobs", "climate adaptation funding", "electric vehicles"]
+    task = "Write an essay about climate change"
+    content = []
+    print(f"{'revision':>8} {'snippets':>9} {'naive tokens':>13} {'budgeted tokens':>16}")
+    for revision in range(1, revisions + 1):
+        for j in range(6):
+            if j % 2 and content:
+                content.append(content[(revision * 5 + j) % len(content)].replace(".", ". "))
+            else:
+                topic = topics[(revision + j) % len(topics)]
+                content.append(f"Revision {revision} finding {j} on {topic}: " + f"{topic} detail. " * 40)
+        critique = f"Add more evidence on {topics[revision % len(topics)]}."
+        naive = estimate_tokens("\n\n".join(content))
+        budgeted = estimate_tokens("\n\n".join(build_context(content, f"{task}\n{critique}", budget)))
+        print(f"{revision:>8} {len(content):>9} {naive:>13,} {budgeted:>16,}")
+
+    timings = []
+    for _ in range(20):
+        start = time.perf_counter()
+        build_context(content, task, budget)
+        timings.append(time.perf_counter() - start)
+    report(f"build_context ({len(content)} snippets)", timings)
+
+
+def install_fakes(llm_latency: float, search_latency: float):
+    # Swap the essay writer's model and search clients for local stand-ins
+    # and disable caches and checkpointing, so only pipeline overhead and the
+    # simulated latency are measured
+    import essay_writer
+    from fakes import FakeAsyncSearchClient, FakeChatModel, FakeSearchClient
+
+    essay_writer.chat_model.set(FakeChatModel(latency=llm_latency))
+    essay_writer.search_client.set(FakeSearchClient(latency=search_latency))
+    essay_writer.async_search_client.set(FakeAsyncSearchClient(latency=search_latency))
+    essay_writer.search_cache.set(None)
+    essay_writer.response_cache = None
+    essay_writer.checkpointer.set(None)
+    essay_writer.invalidate_essay_chain()
+    return essay_writer
+
+
+def essay_inputs(i: int) -> dict:
+    return {
+        "task": f"Write an essay about benchmark topic {i}",
+        "content": [],
+        "max_revisions": 1,
+        "revision_number": 0
+    }
+
+
+def run_measured(label: str, requests: int, run) -> None:
+    tracemalloc.start()
+    start = time.perf_counter()
+    timings = run()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"-- {label}: {requests / elapsed:,.1f} essays/s, peak traced memory {peak / 1024 / 1024:,.1f} MiB")
+    return timings
+
+
+def bench_pipeline(concurrency=(1, 4, 16), requests: int = 32,
+                   llm_latency: float = 0.05, search_latency: float = 0.02):
+    essay_writer = install_fakes(llm_latency, search_latency)
+    chain = essay_writer.get_essay_chain()
+    print(f"fake latency: llm={llm_latency * 1000:.0f}ms search={search_latency * 1000:.0f}ms; "
+          f"the critical path is 6 model calls + 2 search rounds")
+
+    for workers in concurrency:
+        def run():
+            def one(i):
+                start = time.perf_counter()
+                chain.invoke(essay_inputs(i))
+                return time.perf_counter() - start
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                return list(pool.map(one, range(requests)))
+        report(f"chain.invoke x{workers}", run_measured(f"chain.invoke, {workers} threads", requests, run))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["CHAT_DB_PATH"] = os.path.join(tmp, "chat_history.db")
+        os.environ["METRICS_DB_PATH"] = os.path.join(tmp, "metrics.db")
+        import app
+        app.metrics.sink = None
+
+        for workers in concurrency:
+            first_chunk, total = [], []
+
+            async def one(i, semaphore):
+                async with semaphore:
+                    start = time.perf_counter()
+                    first = None
+                    async for _ in app.process_request(f"Write an essay about benchmark topic {i}", [], f"user-{i}"):
+                        if first is None:
+                            first = time.perf_counter() - start
+                    first_chunk.append(first)
+                    total.append(time.perf_counter() - start)
+
+            async def run_all():
+                semaphore = asyncio.Semaphore(workers)
+                await asyncio.gather(*(one(i, semaphore) for i in range(requests)))
+
+            run_measured(f"app.process_request, {workers} concurrent", requests,
+                         lambda: asyncio.run(run_all()))
+            report(f"process_request first chunk x{workers}", first_chunk)
+            report(f"process_request total x{workers}", total)
+        app.db.close()
+
+
+def load_conversations(db: ChatDatabase, start: int, stop: int, users: int):
+    # Small rows with distinct timestamps, spread evenly over `users`
+    conn = db._connect()
+    with conn:
+        conn.executemany('''
+            INSERT INTO conversations
+            (id, user_id, timestamp, task, plan, draft, critique, content, revision_number)
+            VALUES (?, ?, datetime(1700000000 + ?, 'unixepoch'), ?, 'plan', 'draft', 'critique', 'content', 2)
+        ''', ((i + 1, f"user-{i % users}", i, f"Essay task {i}") for i in range(start, stop)))
+        conn.executemany('''
+            INSERT INTO conversation_summaries (user_id, conversation_id, summary)
+            VALUES (?, ?, ?)
+        ''', ((f"user-{i % users}", i + 1, f"Essay about: Essay task {i}") for i in range(start, stop)))
+
+
+def time_history_lookups(db: ChatDatabase, users: int, lookups: int, lookup=None) -> list:
+    lookup = lookup or db.get_history
+    timings = []
+    for n in range(lookups):
+        user_id = f"user-{(n * 7919) % users}"
+        start = time.perf_counter()
+        lookup(user_id)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def bench_db_history(rows: int = 1_000_000, users: int = 10_000, lookups: int = 20):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = ChatDatabase(os.path.join(tmp, "chat_history.db"))
+        conn = db._connect()
+        loaded = 0
+        size = 10_000
+        while loaded < rows:
+            size = min(size, rows)
+            load_conversations(db, loaded, size, users)
+            loaded = size
+            report(f"get_history @ {loaded:,} rows (indexed)", time_history_lookups(db, users, lookups))
+            # Summary columns only, then the same users again from the LRU
+            db.summaries.clear()
+            report(f"get_recent_summaries @ {loaded:,} rows", time_history_lookups(
+                db, users, lookups, db.get_recent_summaries))
+            report(f"get_recent_summaries @ {loaded:,} rows (cached)", time_history_lookups(
+                db, users, lookups, db.get_recent_summaries))
+
+            # Same lookups with the migration's indexes removed
+            with conn:
+                conn.execute('DROP INDEX idx_conversations_user_timestamp')
+                conn.execute('DROP INDEX idx_summaries_conversation')
+            report(f"get_history @ {loaded:,} rows (no indexes)", time_history_lookups(db, users, max(3, lookups // 5)))
+            with conn:
+                for statement in (s for s in MIGRATIONS[0] if isinstance(s, str)):
+                    conn.execute(statement)
+            size *= 10
+        db.close()
+
+
+def slowest_imports(module: str, count: int = 5):
+    # -X importtime writes "import time: self | cumulative | name" to stderr
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def bench_import_time(modules=("essay_writer", "batch", "app"), runs: int = 5):
+    # Cold start of a fresh interpreter, which is what app.py and every
+    # worker process pay before serving their first request
+    code = "import time; start = time.perf_counter(); import {}; print(time.perf_counter() - start)"
+    for module in modules:
+        imports, totals = [], []
+        try:
+            for _ in range(runs):
+                start = time.perf_counter()
+                result = subprocess.run([sys.executable, "-c", code.format(module)],
+                                        capture_output=True, text=True, check=True)
+                totals.append(time.perf_counter() - start)
+                imports.append(float(result.stdout.strip().splitlines()[-1]))
+        except subprocess.CalledProcessError as e:
+            print(f"import {module} failed: {e.stderr.strip().splitlines()[-1]}")
+            continue
+        report(f"import {module}", imports)
+        report(f"python -c 'import {module}' (process)", totals)
+        for cumulative_us, name in slowest_imports(module):
+            print(f"    {cumulative_us / 1000:9.1f}ms  {name}")
+
+
+BENCHMARKS = {
+    "chain": bench_chain,
+    "db-concurrency": bench_db_concurrency,
+    "db-history": bench_db_history,
+    "db-write-behind": bench_db_write_behind,
+    "db-storage": bench_db_storage,
+    "context-budget": bench_context_budget,
+    "pipeline": bench_pipeline,
+    "import-time": bench_import_time,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Essay writer micro-benchmarks")
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+
+    for name in args.names or BENCHMARKS:
+        print(f"== {name}")
+        BENCHMARKS[name]()
@@ -1,15 +1,285 @@
+import hashlib
+import logging
+import queue
 import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 import json
 
+logger = logging.getLogger(__name__)
+
+def _add_legacy_user_column(cursor: sqlite3.Cursor):
+    # Databases created before multi-user support lack conversations.user_id
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(conversations)')]
+    if 'user_id' not in columns:
+        cursor.execute('ALTER TABLE conversations ADD COLUMN user_id TEXT')
+
+# Schema migrations, applied in order by init_db. Each step is a list of SQL
+# statements or callables taking a cursor. PRAGMA user_version records how
+# many steps have already run, so append new steps and never edit old ones.
+MIGRATIONS = [
+    # 1: per-user history lookups and the summaries join
+    [
+        _add_legacy_user_column,
+        'CREATE INDEX IF NOT EXISTS idx_conversations_user_timestamp ON conversations (user_id, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_summaries_conversation ON conversation_summaries (conversation_id)',
+    ],
+    # 2: compact storage (compressed columns, content-addressed research snippets)
+    [
+        'ALTER TABLE conversations ADD COLUMN compressed INTEGER NOT NULL DEFAULT 0',
+        '''
+            CREATE TABLE IF NOT EXISTS research_snippets (
+                hash TEXT PRIMARY KEY,
+                body BLOB NOT NULL
+            )
+        ''',
+    ],
+    # 3: resumable batch runs (see batch.py)
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS batch_items (
+                batch_id TEXT NOT NULL,
+                item_key TEXT NOT NULL,
+                conversation_id INTEGER,
+                completed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (batch_id, item_key),
+                FOREIGN KEY (conversation_id) REFERENCES conversations(id)
+            )
+        ''',
+    ],
+]
+
+def compress_text(text: str) -> bytes:
+    return zlib.compress(text.encode('utf-8'))
+
+def decompress_text(value) -> str:
+    # Plain rows hold TEXT, compact rows hold zlib BLOBs
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode('utf-8')
+    return value
+
+def snippet_hash(snippet: str) -> str:
+    return hashlib.sha256(snippet.encode('utf-8')).hexdigest()
+
+class ConnectionManager:
+    # One long-lived WAL-mode connection per thread. Connections stay open,
+    # so sqlite3's per-connection statement cache keeps prepared statements
+    # around between calls.
+    def __init__(self, db_path: str, busy_timeout_ms: int = 5000, cached_statements: int = 256):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=self.busy_timeout_ms / 1000,
+                cached_statements=self.cached_statements,
+                check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+class SummaryCache:
+    # Per-user LRU of the most recent conversation summaries, newest first.
+    # Saves through the owning ChatDatabase prepend to a cached user's list;
+    # conversations written by other processes appear once the user is
+    # evicted and reloaded.
+    def __init__(self, max_users: int = 1024, depth: int = 5):
+        self.max_users = max_users
+        self.depth = depth
+        self._users = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, user_id: str, limit: int) -> Optional[List[Dict]]:
+        if limit > self.depth:
+            return None
+        with self._lock:
+            entries = self._users.get(user_id)
+            if entries is None:
+                return None
+            self._users.move_to_end(user_id)
+            return list(entries)[:limit]
+
+    def load(self, user_id: str, entries: List[Dict], generation: int):
+        # Rows read from the database; dropped if a save landed since the
+        # read began, as they may be missing it
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._users[user_id] = deque(entries[:self.depth], maxlen=self.depth)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def add(self, items: List[Tuple[str, Dict]]):
+        with self._lock:
+            self._generation += 1
+            for user_id, entry in items:
+                entries = self._users.get(user_id)
+                if entries is not None:
+                    entries.appendleft(entry)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._users.clear()
+
+class WriteBehindError(Exception):
+    # Raised by flush()/close() for queued conversations that were not
+    # written; items holds their (user_id, state, batch_item) tuples
+    def __init__(self, failures: List[Tuple[List[Tuple], Exception]]):
+        self.failures = failures
+        self.items = [item for batch, _ in failures for item in batch]
+        super().__init__(f"{len(self.items)} queued conversations were not written: {failures[-1][1]!r}")
+
+class WriteBehindQueue:
+    # Background writer that groups queued conversations into one
+    # transaction per batch_size items or flush_interval seconds. Failed
+    # writes are kept and raised from the next flush() or close().
+    _STOP = object()
+    _FLUSH = object()
+
+    def __init__(self, db: "ChatDatabase", flush_interval: float = 0.5, batch_size: int = 64):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self._failures = []
+        self._failures_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="chat-db-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, user_id: str, state: Dict, batch_item: Tuple[str, str] = None):
+        self.queue.put((user_id, state, batch_item))
+
+    def flush(self):
+        # Writes everything queued so far without waiting out flush_interval
+        # and blocks until it is done
+        self.queue.put(self._FLUSH)
+        self.queue.join()
+        self._raise_failures()
+
+    def close(self):
+        self.queue.put(self._STOP)
+        self._thread.join()
+        self._raise_failures()
+
+    def _raise_failures(self):
+        with self._failures_lock:
+            failures, self._failures = self._failures, []
+        if failures:
+            raise WriteBehindError(failures)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is self._FLUSH:
+                self.queue.task_done()
+                continue
+            if item is self._STOP:
+                self.queue.task_done()
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is self._FLUSH or item is self._STOP:
+                    self.queue.task_done()
+                    stopping = item is self._STOP
+                    break
+                batch.append(item)
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+        # Drain anything queued after the stop marker
+        remaining = []
+        while True:
+            try:
+                remaining.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            self._write([item for item in remaining if item is not self._STOP and item is not self._FLUSH])
+        finally:
+            for _ in remaining:
+                self.queue.task_done()
+
+    def _write(self, batch: List[Tuple]):
+        if not batch:
+            return
+        try:
+            self.db.save_conversations(
+                [(user_id, state) for user_id, state, _ in batch],
+                [batch_item for _, _, batch_item in batch]
+            )
+        except Exception as e:
+            logger.exception("Failed to write %d queued conversations", len(batch))
+            with self._failures_lock:
+                self._failures.append((batch, e))
+
 class ChatDatabase:
-    def __init__(self, db_path="chat_history.db"):
+    def __init__(self, db_path="chat_history.db", write_behind=False, flush_interval=0.5, batch_size=64,
+                 compact=False):
         self.db_path = db_path
+        # compact: zlib-compress plan/draft/critique and store research
+        # snippets once in research_snippets, referenced by hash
+        self.compact = compact
+        self.connections = ConnectionManager(db_path)
         self.init_db()
+        self.writer = WriteBehindQueue(self, flush_interval, batch_size) if write_behind else None
+        # Recent summaries for the history panel, see get_recent_summaries()
+        self.summaries = SummaryCache()
+
+    def _connect(self) -> sqlite3.Connection:
+        return self.connections.connection()
+
+    def close(self):
+        # Drain queued writes before closing connections
+        try:
+            if self.writer is not None:
+                writer, self.writer = self.writer, None
+                writer.close()
+        finally:
+            self.connections.close_all()
 
     def init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             # Create users table
             cursor.execute('''
@@ -48,9 +318,33 @@ class ChatDatabase:
                 )
             ''')
             conn.commit()
+            self.migrate(conn)
+
+    def migrate(self, conn: sqlite3.Connection):
+        # Each step runs in its own IMMEDIATE transaction, with user_version
+        # re-read under the write lock, so processes opening a fresh database
+        # at the same time apply every step exactly once
+        cursor = conn.cursor()
+        while True:
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                version = cursor.execute('PRAGMA user_version').fetchone()[0]
+                if version >= len(MIGRATIONS):
+                    conn.rollback()
+                    return
+                for statement in MIGRATIONS[version]:
+                    if callable(statement):
+                        statement(cursor)
+                    else:
+                        cursor.execute(statement)
+                cursor.execute(f'PRAGMA user_version = {version + 1}')
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
 
     def create_or_get_user(self, user_id: str, username: str) -> Dict:
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT OR IGNORE INTO users (user_id, username)
@@ -76,26 +370,81 @@ class ChatDatabase:
                 }
             return None
 
+    def _conversation_row(self, user_id: str, state: Dict) -> Tuple:
+        content = state.get('content', [])
+        if self.compact:
+            return (
+                user_id,
+                state.get('task', ''),
+                compress_text(state.get('plan', '')),
+                compress_text(state.get('draft', '')),
+                compress_text(state.get('critique', '')),
+                '\n'.join(snippet_hash(snippet) for snippet in content),
+                state.get('revision_number', 1),
+                1
+            )
+        return (
+            user_id,
+            state.get('task', ''),
+            state.get('plan', ''),
+            state.get('draft', ''),
+            state.get('critique', ''),
+            '\n'.join(content),
+            state.get('revision_number', 1),
+            0
+        )
+
+    def _store_snippets(self, cursor: sqlite3.Cursor, states: List[Dict]):
+        if not self.compact:
+            return
+        snippets = {snippet_hash(snippet): snippet
+                    for state in states for snippet in state.get('content', [])}
+        # Only compress snippets that are not stored yet
+        hashes = list(snippets)
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            cursor.execute(f'''
+                SELECT hash FROM research_snippets
+                WHERE hash IN ({','.join('?' * len(chunk))})
+            ''', chunk)
+            for (digest,) in cursor.fetchall():
+                del snippets[digest]
+        cursor.executemany('''
+            INSERT OR IGNORE INTO research_snippets (hash, body) VALUES (?, ?)
+        ''', [(digest, compress_text(snippet)) for digest, snippet in snippets.items()])
+
+    def _load_snippets(self, cursor: sqlite3.Cursor, hashes: List[str]) -> List[str]:
+        bodies = {}
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            cursor.execute(f'''
+                SELECT hash, body FROM research_snippets
+                WHERE hash IN ({','.join('?' * len(chunk))})
+            ''', chunk)
+            bodies.update((digest, decompress_text(body)) for digest, body in cursor.fetchall())
+        return [bodies[digest] for digest in hashes if digest in bodies]
+
+    @staticmethod
+    def _summary(state: Dict) -> str:
+        return f"Essay about: {state.get('task', '')} (Revision {state.get('revision_number', 1)})"
+
+    @staticmethod
+    def _summary_entry(conversation_id: int, task: str, summary: str) -> Dict:
+        return {'conversation_id': conversation_id, 'task': task, 'summary': summary}
+
     def save_conversation(self, user_id: str, state: Dict):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
+            self._store_snippets(cursor, [state])
             cursor.execute('''
                 INSERT INTO conversations 
-                (user_id, task, plan, draft, critique, content, revision_number)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                user_id,
-                state.get('task', ''),
-                state.get('plan', ''),
-                state.get('draft', ''),
-                state.get('critique', ''),
-                '\n'.join(state.get('content', [])),
-                state.get('revision_number', 1)
-            ))
+                (user_id, task, plan, draft, critique, content, revision_number, compressed)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', self._conversation_row(user_id, state))
             conversation_id = cursor.lastrowid
             
             # Generate and save summary
-            summary = f"Essay about: {state.get('task', '')} (Revision {state.get('revision_number', 1)})"
+            summary = self._summary(state)
             cursor.execute('''
                 INSERT INTO conversation_summaries 
                 (user_id, conversation_id, summary)
@@ -103,10 +452,72 @@ class ChatDatabase:
             ''', (user_id, conversation_id, summary))
             
             conn.commit()
-            return conversation_id
+        self.summaries.add([(user_id, self._summary_entry(conversation_id, state.get('task', ''), summary))])
+        return conversation_id
+
+    def save_conversations(self, items: List[Tuple[str, Dict]],
+                           batch_items: List[Optional[Tuple[str, str]]] = None) -> List[int]:
+        # Bulk variant of save_conversation: one transaction, two executemany
+        # calls. Ids are reserved up front under an IMMEDIATE lock so the
+        # summaries can reference them. batch_items optionally marks each
+        # conversation as a completed (batch_id, item_key) of a batch run in
+        # the same transaction.
+        if not items:
+            return []
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT MAX(
+                    COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'conversations'), 0),
+                    COALESCE((SELECT MAX(id) FROM conversations), 0)
+                )
+            ''')
+            first_id = cursor.fetchone()[0] + 1
+            ids = list(range(first_id, first_id + len(items)))
+            summaries = [self._summary(state) for _, state in items]
+            self._store_snippets(cursor, [state for _, state in items])
+            cursor.executemany('''
+                INSERT INTO conversations 
+                (id, user_id, task, plan, draft, critique, content, revision_number, compressed)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(conversation_id, *self._conversation_row(user_id, state))
+                  for conversation_id, (user_id, state) in zip(ids, items)])
+            cursor.executemany('''
+                INSERT INTO conversation_summaries 
+                (user_id, conversation_id, summary)
+                VALUES (?, ?, ?)
+            ''', [(user_id, conversation_id, summary)
+                  for conversation_id, (user_id, _), summary in zip(ids, items, summaries)])
+            if batch_items:
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO batch_items
+                    (batch_id, item_key, conversation_id)
+                    VALUES (?, ?, ?)
+                ''', [(batch_item[0], batch_item[1], conversation_id)
+                      for conversation_id, batch_item in zip(ids, batch_items) if batch_item])
+        self.summaries.add([
+            (user_id, self._summary_entry(conversation_id, state.get('task', ''), summary))
+            for conversation_id, (user_id, state), summary in zip(ids, items, summaries)
+        ])
+        return ids
+
+    def enqueue_conversation(self, user_id: str, state: Dict, batch_item: Tuple[str, str] = None):
+        # Off the request path when write-behind is enabled
+        if self.writer is None:
+            if batch_item:
+                return self.save_conversations([(user_id, state)], [batch_item])[0]
+            return self.save_conversation(user_id, state)
+        self.writer.put(user_id, state, batch_item)
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
 
     def get_recent_conversations(self, user_id: str, limit=5):
-        with sqlite3.connect(self.db_path) as conn:
+        # Rows come back as stored: in compact mode plan/draft/critique are
+        # compressed BLOBs, see get_conversation() for the full text
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT c.*, s.summary 
@@ -118,8 +529,30 @@ class ChatDatabase:
             ''', (user_id, limit))
             return cursor.fetchall()
 
+    def get_recent_summaries(self, user_id: str, limit=5) -> List[Dict]:
+        # Newest first, as {conversation_id, task, summary}. Served from the
+        # per-user cache when possible; the query reads only the columns it
+        # returns, never the plan/draft/critique/content text.
+        summaries = self.summaries.get(user_id, limit)
+        if summaries is not None:
+            return summaries
+        generation = self.summaries.generation
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT c.id, c.task, s.summary
+                FROM conversations c
+                LEFT JOIN conversation_summaries s ON c.id = s.conversation_id
+                WHERE c.user_id = ?
+                ORDER BY c.timestamp DESC, c.id DESC
+                LIMIT ?
+            ''', (user_id, max(limit, self.summaries.depth)))
+            summaries = [self._summary_entry(*row) for row in cursor.fetchall()]
+        self.summaries.load(user_id, summaries, generation)
+        return summaries[:limit]
+
     def get_last_conversation_summary(self, user_id: str) -> str:
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT c.task, c.plan, c.draft, s.summary
@@ -133,8 +566,73 @@ class ChatDatabase:
             if result:
                 return {
                     'task': result[0],
-                    'plan': result[1],
-                    'draft': result[2],
+                    'plan': decompress_text(result[1]),
+                    'draft': decompress_text(result[2]),
                     'summary': result[3]
                 }
             return None
+
+    def get_history(self, user_id: str, limit=5) -> Tuple[List, Optional[Dict]]:
+        # Recent conversations and the last summary from a single indexed query
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT c.*, s.summary
+                FROM conversations c
+                LEFT JOIN conversation_summaries s ON c.id = s.conversation_id
+                WHERE c.user_id = ?
+                ORDER BY c.timestamp DESC
+                LIMIT ?
+            ''', (user_id, limit))
+            recent = cursor.fetchall()
+            if not recent:
+                return recent, None
+            columns = [column[0] for column in cursor.description]
+            last = dict(zip(columns, recent[0]))
+            # Only the last conversation is decompressed; the listing rows are
+            # returned as stored
+            return recent, {
+                'task': last['task'],
+                'plan': decompress_text(last['plan']),
+                'draft': decompress_text(last['draft']),
+                'summary': last['summary']
+            }
+
+    def get_conversation(self, conversation_id: int) -> Optional[Dict]:
+        # Full, decompressed conversation, including research snippets
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, user_id, timestamp, task, plan, draft, critique, content, revision_number, compressed
+                FROM conversations
+                WHERE id = ?
+            ''', (conversation_id,))
+            result = cursor.fetchone()
+            if not result:
+                return None
+            content = result[7] or ''
+            if result[9]:
+                snippets = self._load_snippets(cursor, content.split('\n') if content else [])
+            else:
+                # Plain rows store the snippets newline-joined, and snippets
+                # contain newlines themselves, so the text is returned whole
+                snippets = [content] if content else []
+            return {
+                'id': result[0],
+                'user_id': result[1],
+                'timestamp': result[2],
+                'task': result[3],
+                'plan': decompress_text(result[4]),
+                'draft': decompress_text(result[5]),
+                'critique': decompress_text(result[6]),
+                'content': snippets,
+                'revision_number': result[8]
+            }
+
+    def get_completed_batch_items(self, batch_id: str) -> set:
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT item_key FROM batch_items WHERE batch_id = ?
+            ''', (batch_id,))
+            return {row[0] for row in cursor.fetchall()}
@@ -0,0 +1,77 @@
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import MemorySaver
+
+# Checkpoint backends for the essay graph, selected by name:
+#   none    no checkpoints; nothing can be resumed
+#   memory  in-process MemorySaver keeping the most recent max_threads threads
+#   sqlite  a dedicated WAL-mode SQLite file, separate from chat_history.db
+CHECKPOINTERS = ("none", "memory", "sqlite")
+
+
+class BoundedMemorySaver(MemorySaver):
+    # MemorySaver that evicts the least recently written threads
+    def __init__(self, max_threads: int = 1000):
+        super().__init__()
+        self.max_threads = max_threads
+        self._threads = OrderedDict()
+        self._threads_lock = threading.Lock()
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        result = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = config["configurable"]["thread_id"]
+        with self._threads_lock:
+            self._threads[thread_id] = True
+            self._threads.move_to_end(thread_id)
+            evicted = []
+            while len(self._threads) > self.max_threads:
+                evicted.append(self._threads.popitem(last=False)[0])
+        for old_thread_id in evicted:
+            self.delete_thread(old_thread_id)
+        return result
+
+
+def _sqlite_saver(path: str):
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    class ThreadedSqliteSaver(SqliteSaver):
+        # SqliteSaver is sync-only; the async graph APIs (astream/ainvoke)
+        # run its methods in a worker thread instead of requiring aiosqlite
+        async def aget_tuple(self, config):
+            return await asyncio.to_thread(self.get_tuple, config)
+
+        async def alist(self, config, *, filter=None, before=None, limit=None):
+            items = await asyncio.to_thread(
+                lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+            for item in items:
+                yield item
+
+        async def aput(self, config, checkpoint, metadata, new_versions):
+            return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+        async def aput_writes(self, config, writes, task_id, task_path=""):
+            return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+        async def adelete_thread(self, thread_id):
+            return await asyncio.to_thread(self.delete_thread, thread_id)
+
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return ThreadedSqliteSaver(conn)
+
+
+def make_checkpointer(kind: str, sqlite_path: str = "checkpoints.db",
+                      max_threads: int = 1000) -> Optional[BaseCheckpointSaver]:
+    if kind == "none":
+        return None
+    if kind == "memory":
+        return BoundedMemorySaver(max_threads)
+    if kind == "sqlite":
+        return _sqlite_saver(sqlite_path)
+    raise ValueError(f"Unknown checkpointer {kind!r}, expected one of {', '.join(CHECKPOINTERS)}")
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+from typing import AsyncIterator, Callable, Dict, Hashable, List, Optional
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class _Stream:
+    def __init__(self):
+        self.events: List = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+
+class SingleFlight:
+    # Concurrent calls with the same key share one execution: the first
+    # caller runs it, later ones wait for its result (or exception). Nothing
+    # is kept once the execution finishes, so this is deduplication, not a
+    # cache. on_join is called whenever a caller joins a running execution.
+    def __init__(self, on_join: Optional[Callable[[], None]] = None):
+        self.on_join = on_join
+        self.executions = 0
+        self.joined = 0
+        self._calls: Dict[Hashable, _Call] = {}
+        self._streams: Dict[Hashable, _Stream] = {}
+        self._lock = threading.Lock()
+
+    def _join(self):
+        self.joined += 1
+        if self.on_join is not None:
+            self.on_join()
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                self._join()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def astream(self, key: Hashable, stream_fn: Callable[..., AsyncIterator], *args) -> AsyncIterator:
+        # Async-iterator variant. Callers share a run only with callers on the
+        # same event loop, and each receives all events from the start. The
+        # source runs as its own task, so a caller that stops early does not
+        # cancel it for the others.
+        loop = asyncio.get_running_loop()
+        key = (loop, key)
+        stream = self._streams.get(key)
+        if stream is None:
+            stream = self._streams[key] = _Stream()
+            self.executions += 1
+            stream.task = loop.create_task(self._produce(key, stream, stream_fn(*args)))
+        else:
+            self._join()
+
+        index = 0
+        while True:
+            async with stream.changed:
+                await stream.changed.wait_for(lambda: len(stream.events) > index or stream.finished)
+                events, finished = stream.events[index:], stream.finished
+            for event in events:
+                yield event
+            index += len(events)
+            if finished:
+                if stream.error is not None:
+                    raise stream.error
+                return
+
+    async def _produce(self, key: Hashable, stream: _Stream, source: AsyncIterator):
+        try:
+            async for event in source:
+                async with stream.changed:
+                    stream.events.append(event)
+                    stream.changed.notify_all()
+        except Exception as e:
+            stream.error = e
+        finally:
+            if self._streams.get(key) is stream:
+                del self._streams[key]
+            async with stream.changed:
+                stream.finished = True
+                stream.changed.notify_all()
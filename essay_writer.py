@@ -1,19 +1,71 @@
 from dotenv import load_dotenv
-from langgraph.graph import StateGraph, END
-from typing import TypedDict, Annotated, List
+from typing import TYPE_CHECKING, TypedDict, Annotated, Dict, List
 import operator
-from langgraph.checkpoint.memory import MemorySaver
-from langgraph.checkpoint.sqlite import SqliteSaver
-from langchain_core.messages import AnyMessage, SystemMessage, HumanMessage, AIMessage, ChatMessage
-from langchain_openai import ChatOpenAI
-from pydantic import BaseModel
-from tavily import TavilyClient
+from providers import Provider
+from coalesce import SingleFlight
+from llm_cache import ResponseCache, response_tokens
+from research_context import build_context, estimate_tokens
+from scheduler import DeadlineExceeded, RateLimiter, is_retryable, retries_exhausted
+from metrics import instrument, registry as metrics
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import asyncio
+import contextvars
+import functools
+import json
+import logging
 import os
+import re
+import threading
+import time
+import weakref
+
+if TYPE_CHECKING:
+    from langchain_core.runnables import RunnableConfig
 
 
 load_dotenv()
 
-memory = SqliteSaver.from_conn_string("chat_history.db")
+logger = logging.getLogger(__name__)
+
+# langgraph, langchain and tavily are imported, and their clients built, on
+# first use so that importing this module stays cheap and works without API
+# keys. Swap any of them with e.g. chat_model.set(...) or
+# chat_model.override(...).
+
+def _build_checkpointer():
+    from checkpointing import make_checkpointer
+    return make_checkpointer(
+        CHECKPOINTER,
+        sqlite_path=os.environ.get("ESSAY_CHECKPOINT_DB", "checkpoints.db"),
+        max_threads=int(os.environ.get("ESSAY_CHECKPOINT_MAX_THREADS", 1000))
+    )
+
+def _build_chat_model():
+    from langchain_openai import ChatOpenAI
+    # Retries are left to openai_limiter
+    return ChatOpenAI(model="gpt-3.5-turbo", temperature=0, max_retries=0)
+
+def _build_search_client():
+    from tavily import TavilyClient
+    return TavilyClient(api_key=os.environ["TAVILY_API_KEY"])
+
+def _build_async_search_client():
+    from tavily import AsyncTavilyClient
+    return AsyncTavilyClient(api_key=os.environ["TAVILY_API_KEY"])
+
+def _build_search_cache():
+    from search_cache import SearchCache
+    return SearchCache()
+
+# Checkpoint backend: "none", "memory" (bounded, in-process) or "sqlite" (a
+# WAL file of its own, so checkpoints never contend with chat_history.db)
+CHECKPOINTER = os.environ.get("ESSAY_CHECKPOINTER", "memory")
+checkpointer = Provider(_build_checkpointer)
+
+# When checkpoints are written. "exit" saves once, when a run finishes or
+# fails, which is the only boundary a resume needs; "async"/"sync" save
+# after every step.
+CHECKPOINT_DURABILITY = os.environ.get("ESSAY_CHECKPOINT_DURABILITY", "exit")
 
 
 class AgentState(TypedDict):
@@ -21,12 +73,49 @@ class AgentState(TypedDict):
     plan:str
     draft: str
     critique: str
-    content: List[str]
+    # Reducer: nodes return only new snippets and LangGraph appends them
+    content: Annotated[List[str], operator.add]
+    # Search queries already run for this essay
+    queries: Annotated[List[str], operator.add]
+    # New queries the latest critique asks for; none sends it to the writer
+    critique_queries: List[str]
     max_revisions: int
     revision_number: int
 
 
-model = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
+chat_model = Provider(_build_chat_model)
+
+# Every model and search call goes through a limiter that holds it to the
+# account's limits (0 = unlimited) and retries 429s and transient errors with
+# jittered backoff. A node that fails for another retryable reason is retried
+# by LangGraph (NODE_RETRY_ATTEMPTS), but not on errors the limiter already
+# gave up on; nodes that already finished are not rerun.
+openai_limiter = RateLimiter(
+    "openai",
+    requests_per_minute=float(os.environ.get("OPENAI_REQUESTS_PER_MINUTE", 0)),
+    tokens_per_minute=float(os.environ.get("OPENAI_TOKENS_PER_MINUTE", 0))
+)
+tavily_limiter = RateLimiter(
+    "tavily",
+    requests_per_minute=float(os.environ.get("TAVILY_REQUESTS_PER_MINUTE", 0))
+)
+NODE_RETRY_ATTEMPTS = 3
+
+def should_retry_node(error: BaseException) -> bool:
+    return is_retryable(error) and not retries_exhausted(error)
+
+# Tokens/min are charged up front as prompt + this, then corrected from the
+# reported usage
+ESTIMATED_COMPLETION_TOKENS = 500
+
+# Planner and reflection prompts are deterministic (temperature=0), so their
+# completions are cached. LLM_CACHE_SIMILARITY_THRESHOLD (e.g. 0.9) also
+# serves near-identical tasks from the cache.
+_similarity_threshold = os.environ.get("LLM_CACHE_SIMILARITY_THRESHOLD")
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 1000)),
+    similarity_threshold=float(_similarity_threshold) if _similarity_threshold else None
+)
 
 PLAN_PROMPT = """You are an expert writer tasked with writing a high level outline of an essay. \
 Write such an outline for the user provided topic. Give an outline of the essay along with any relevant notes \
@@ -54,100 +143,513 @@ be used when making any requested revisions (as outlined below). \
 Generate a list of search queries that will gather any relevant information. Only generate 3 queries max."""
 
 
-class Queries(BaseModel):
-    queries: List[str]
+@functools.lru_cache(maxsize=None)
+def queries_schema():
+    # Built on first use so pydantic is only imported when queries are
+    from pydantic import BaseModel
 
-tavily = TavilyClient(api_key=os.environ["TAVILY_API_KEY"])
+    class Queries(BaseModel):
+        queries: List[str]
 
-def plan_node(state: AgentState):
-    messages = [
-        SystemMessage(content=PLAN_PROMPT), 
-        HumanMessage(content=state['task'])
+    return Queries
+
+search_client = Provider(_build_search_client)
+async_search_client = Provider(_build_async_search_client)
+
+# Research fan-out: queries run concurrently on a shared, bounded pool
+MAX_SEARCH_WORKERS = 6
+SEARCH_TIMEOUT = 15  # seconds per query, from when it starts running
+# How often a caller waiting on queued searches checks whether they started
+SEARCH_POLL_SECONDS = 0.05
+
+search_pool = ThreadPoolExecutor(max_workers=MAX_SEARCH_WORKERS, thread_name_prefix="search")
+
+# Search results are shared across essays; search_cache.set(None) always
+# hits Tavily
+search_cache = Provider(_build_search_cache)
+
+def cached_search(query: str, max_results: int = 2, deadline: float = None) -> Dict:
+    # deadline (time.monotonic()) bounds the rate limiter's waits and retries
+    metrics.record("searches")
+    cache = search_cache.get()
+    if cache is not None:
+        response = cache.get(query, max_results)
+        if response is not None:
+            metrics.record("search_cache_hits")
+            return response
+    with metrics.timer("search_seconds"):
+        response = tavily_limiter.call(search_client.get().search, query=query, max_results=max_results,
+                                       deadline=deadline)
+    if cache is not None:
+        cache.put(query, max_results, response)
+    return response
+
+async def acached_search(query: str, max_results: int = 2, deadline: float = None) -> Dict:
+    metrics.record("searches")
+    cache = search_cache.get()
+    if cache is not None:
+        response = await asyncio.to_thread(cache.get, query, max_results)
+        if response is not None:
+            metrics.record("search_cache_hits")
+            return response
+    with metrics.timer("search_seconds"):
+        response = await tavily_limiter.acall(async_search_client.get().search, query=query,
+                                              max_results=max_results, deadline=deadline)
+    if cache is not None:
+        await asyncio.to_thread(cache.put, query, max_results, response)
+    return response
+
+def _started_search(started: List, index: int, query: str, max_results: int) -> Dict:
+    started[index] = time.monotonic()
+    return cached_search(query, max_results, deadline=started[index] + SEARCH_TIMEOUT)
+
+def _drop_search(query: str):
+    logger.warning("Dropping search %r: no result within %ss", query, SEARCH_TIMEOUT)
+    metrics.record("search_timeouts")
+
+def search_queries(queries: List[str], max_results: int = 2) -> List[str]:
+    # Each task runs in a copy of the caller's context so its metrics are
+    # attributed to the calling node. A query's SEARCH_TIMEOUT starts when a
+    # pool thread picks it up, so time queued behind other essays' searches
+    # does not count against it.
+    started = [None] * len(queries)
+    futures = [
+        search_pool.submit(contextvars.copy_context().run, _started_search, started, i, q, max_results)
+        for i, q in enumerate(queries)
     ]
-    response = model.invoke(messages)
-    return {"plan": response.content}
+    pending = set(futures)
+    while pending:
+        now = time.monotonic()
+        wake = []
+        for i, future in enumerate(futures):
+            if future not in pending:
+                continue
+            if started[i] is None:
+                wake.append(now + SEARCH_POLL_SECONDS)
+            elif now - started[i] >= SEARCH_TIMEOUT:
+                pending.discard(future)
+            else:
+                wake.append(started[i] + SEARCH_TIMEOUT)
+        if pending:
+            _, pending = wait(pending, timeout=min(wake) - now, return_when=FIRST_COMPLETED)
 
-def research_plan_node(state: AgentState):
-    queries = model.with_structured_output(Queries).invoke([
-        SystemMessage(content=RESEARCH_PLAN_PROMPT),
-        HumanMessage(content=state['task'])
-    ])
-    content = state['content'] or []
-    for q in queries.queries:
-        response = tavily.search(query=q, max_results=2)
+    # Merge in query order so content stays deterministic
+    content = []
+    for query, future in zip(queries, futures):
+        if not future.done():
+            future.cancel()
+            _drop_search(query)
+            continue
+        try:
+            response = future.result()
+        except DeadlineExceeded:
+            _drop_search(query)
+            continue
         for r in response['results']:
             content.append(r['content'])
-    return {"content": content, "queries": queries.queries}
+    return content
 
+# The async counterpart of search_pool: one MAX_SEARCH_WORKERS limit per
+# event loop, shared by every essay running on it
+_search_semaphores = weakref.WeakKeyDictionary()
+_search_semaphores_lock = threading.Lock()
 
-def generation_node(state: AgentState):
-    content = "\n\n".join(state['content'] or [])
+def _search_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    with _search_semaphores_lock:
+        semaphore = _search_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = _search_semaphores[loop] = asyncio.Semaphore(MAX_SEARCH_WORKERS)
+    return semaphore
+
+async def asearch_queries(queries: List[str], max_results: int = 2) -> List[str]:
+    semaphore = _search_semaphore()
+
+    async def search(q):
+        # Timed from when the query gets a slot, like search_queries()
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(
+                    acached_search(q, max_results, deadline=time.monotonic() + SEARCH_TIMEOUT),
+                    timeout=SEARCH_TIMEOUT
+                )
+            except (asyncio.TimeoutError, DeadlineExceeded):
+                _drop_search(q)
+                return None
+
+    content = []
+    for response in await asyncio.gather(*(search(q) for q in queries)):
+        if response is None:
+            continue
+        for r in response['results']:
+            content.append(r['content'])
+    return content
+
+def _cache_namespace():
+    model = chat_model.get()
+    return f"{getattr(model, 'model_name', type(model).__name__)}:{getattr(model, 'temperature', '')}"
+
+def estimated_tokens(messages) -> int:
+    return sum(estimate_tokens(str(m.content)) for m in messages) + ESTIMATED_COMPLETION_TOKENS
+
+def used_tokens(response):
+    # None when the provider reported no usage
+    if isinstance(response, dict):  # with_structured_output(include_raw=True)
+        response = response["raw"]
+    return response_tokens(response) or None
+
+def invoke_model(messages, config: "RunnableConfig" = None):
+    metrics.record("llm_calls")
+    with metrics.timer("llm_seconds"):
+        response = openai_limiter.call(chat_model.get().invoke, messages, config,
+                                       tokens=estimated_tokens(messages), usage=used_tokens)
+    metrics.record_llm_usage(response)
+    return response
+
+async def ainvoke_model(messages, config: "RunnableConfig" = None):
+    metrics.record("llm_calls")
+    with metrics.timer("llm_seconds"):
+        response = await openai_limiter.acall(chat_model.get().ainvoke, messages, config,
+                                              tokens=estimated_tokens(messages), usage=used_tokens)
+    metrics.record_llm_usage(response)
+    return response
+
+def cached_invoke(messages):
+    if response_cache is None:
+        return invoke_model(messages)
+    response = response_cache.lookup(messages, _cache_namespace())
+    if response is None:
+        response = invoke_model(messages)
+        response_cache.store(messages, response, _cache_namespace())
+    else:
+        metrics.record("llm_cache_hits")
+    return response
+
+async def acached_invoke(messages):
+    if response_cache is None:
+        return await ainvoke_model(messages)
+    response = response_cache.lookup(messages, _cache_namespace())
+    if response is None:
+        response = await ainvoke_model(messages)
+        response_cache.store(messages, response, _cache_namespace())
+    else:
+        metrics.record("llm_cache_hits")
+    return response
+
+def _parsed_queries(result):
+    # include_raw=True keeps the AIMessage, and with it the token usage
+    metrics.record_llm_usage(result["raw"])
+    if result.get("parsing_error"):
+        raise result["parsing_error"]
+    return result["parsed"]
+
+def generate_queries(prompt: str, text: str):
+    from langchain_core.messages import SystemMessage, HumanMessage
+    messages = [SystemMessage(content=prompt), HumanMessage(content=text)]
+    metrics.record("llm_calls")
+    with metrics.timer("llm_seconds"):
+        result = openai_limiter.call(
+            chat_model.get().with_structured_output(queries_schema(), include_raw=True).invoke, messages,
+            tokens=estimated_tokens(messages), usage=used_tokens)
+    return _parsed_queries(result)
+
+async def agenerate_queries(prompt: str, text: str):
+    from langchain_core.messages import SystemMessage, HumanMessage
+    messages = [SystemMessage(content=prompt), HumanMessage(content=text)]
+    metrics.record("llm_calls")
+    with metrics.timer("llm_seconds"):
+        result = await openai_limiter.acall(
+            chat_model.get().with_structured_output(queries_schema(), include_raw=True).ainvoke, messages,
+            tokens=estimated_tokens(messages), usage=used_tokens)
+    return _parsed_queries(result)
+
+def plan_messages(state: AgentState):
+    from langchain_core.messages import SystemMessage, HumanMessage
+    return [
+        SystemMessage(content=PLAN_PROMPT), 
+        HumanMessage(content=state['task'])
+    ]
+
+# Research snippets handed to the writer are deduplicated, ranked by BM25
+# against the task and critique, and packed into this many tokens
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 3000))
+
+def writer_messages(state: AgentState):
+    from langchain_core.messages import SystemMessage, HumanMessage
+    query = f"{state['task']}\n{state.get('critique') or ''}"
+    content = "\n\n".join(build_context(state['content'] or [], query, CONTEXT_TOKEN_BUDGET))
     user_message = HumanMessage(
         content=f"{state['task']}\n\nHere is my plan:\n\n{state['plan']}")
-    messages = [
+    return [
         SystemMessage(
             content=WRITER_PROMPT.format(content=content)
         ),
         user_message
         ]
-    response = model.invoke(messages)
+
+def reflection_messages(state: AgentState):
+    from langchain_core.messages import SystemMessage, HumanMessage
+    return [
+        SystemMessage(content=REFLECTION_PROMPT), 
+        HumanMessage(content=state['draft'])
+    ]
+
+def plan_node(state: AgentState):
+    response = cached_invoke(plan_messages(state))
+    return {"plan": response.content}
+
+def research_plan_node(state: AgentState):
+    queries = generate_queries(RESEARCH_PLAN_PROMPT, state['task'])
+    return {"content": search_queries(queries.queries), "queries": queries.queries}
+
+
+def generation_node(state: AgentState):
+    response = invoke_model(writer_messages(state))
     return {
         "draft": response.content, 
         "revision_number": state.get("revision_number", 1) + 1
     }
 
 def reflection_node(state: AgentState):
-    messages = [
-        SystemMessage(content=REFLECTION_PROMPT), 
-        HumanMessage(content=state['draft'])
-    ]
-    response = model.invoke(messages)
-    return {"critique": response.content}
+    response = cached_invoke(reflection_messages(state))
+    return {
+        "critique": response.content,
+        "critique_queries": critique_queries(response.content, state.get('queries') or [])
+    }
 
 def research_critique_node(state: AgentState):
-    queries = model.with_structured_output(Queries).invoke([
-        SystemMessage(content=RESEARCH_CRITIQUE_PROMPT),
-        HumanMessage(content=state['critique'])
-    ])
-    content = state['content'] or []
-    for q in queries.queries:
-        response = tavily.search(query=q, max_results=2)
-        for r in response['results']:
-            content.append(r['content'])
-    return {"content": content, "queries": queries.queries}
+    queries = state['critique_queries']
+    return {"content": search_queries(queries), "queries": queries}
+
+# Async variants, used when the graph is driven with ainvoke/astream
+
+async def aplan_node(state: AgentState):
+    response = await acached_invoke(plan_messages(state))
+    return {"plan": response.content}
+
+async def aresearch_plan_node(state: AgentState):
+    queries = await agenerate_queries(RESEARCH_PLAN_PROMPT, state['task'])
+    return {"content": await asearch_queries(queries.queries), "queries": queries.queries}
+
+async def ageneration_node(state: AgentState, config: "RunnableConfig" = None):
+    # Building the research context is CPU-bound; keep it off the event loop
+    messages = await asyncio.to_thread(writer_messages, state)
+    # config carries the graph's callbacks, which is how writer tokens reach
+    # astream_essay()
+    response = await ainvoke_model(messages, config)
+    return {
+        "draft": response.content, 
+        "revision_number": state.get("revision_number", 1) + 1
+    }
+
+async def areflection_node(state: AgentState):
+    response = await acached_invoke(reflection_messages(state))
+    return {
+        "critique": response.content,
+        "critique_queries": await acritique_queries(response.content, state.get('queries') or [])
+    }
+
+async def aresearch_critique_node(state: AgentState):
+    queries = state['critique_queries']
+    return {"content": await asearch_queries(queries), "queries": queries}
+
+# A critique only sends the essay back to research when it asks for new
+# material and that material needs searches not already run (new_queries);
+# style-only feedback goes straight to the writer without a query
+# generation call
+RESEARCH_TERMS = re.compile(
+    r"\b(evidence|statistic\w*|data|examples?|sources?|cit(e|es|ation\w*)|research\w*|"
+    r"facts?|stud(y|ies)|figures?|recent|references?|case stud\w*)\b",
+    re.IGNORECASE
+)
+
+# Critique queries this similar (word Jaccard) to one already run are skipped
+QUERY_OVERLAP_THRESHOLD = 0.6
+
+def _query_words(query: str) -> set:
+    return set(re.findall(r"\w+", query.lower()))
+
+def new_queries(queries: List[str], previous: List[str]) -> List[str]:
+    seen = [_query_words(q) for q in previous]
+    fresh = []
+    for query in queries:
+        words = _query_words(query)
+        if not words or any(
+            len(words & other) / len(words | other) >= QUERY_OVERLAP_THRESHOLD for other in seen
+        ):
+            continue
+        seen.append(words)
+        fresh.append(query)
+    return fresh
+
+def critique_queries(critique: str, previous: List[str]) -> List[str]:
+    if not RESEARCH_TERMS.search(critique or ''):
+        return []
+    queries = generate_queries(RESEARCH_CRITIQUE_PROMPT, critique)
+    return new_queries(queries.queries, previous)
+
+async def acritique_queries(critique: str, previous: List[str]) -> List[str]:
+    if not RESEARCH_TERMS.search(critique or ''):
+        return []
+    queries = await agenerate_queries(RESEARCH_CRITIQUE_PROMPT, critique)
+    return new_queries(queries.queries, previous)
+
+def route_after_reflection(state):
+    if state.get('critique_queries'):
+        return "research"
+    return "write"
 
 def should_continue(state):
+    from langgraph.graph import END
     if state["revision_number"] > state["max_revisions"]:
         return END
     return "reflect"
 
 
-def create_essay_chain():
+def graph_node(name: str, func, afunc):
+    # Each node carries a sync and an async implementation, so the same
+    # compiled chain serves both invoke() and ainvoke()/astream(); both are
+    # timed and attributed to the node in metrics
+    from langchain_core.runnables import RunnableLambda
+    return RunnableLambda(instrument(name, func), afunc=instrument(name, afunc))
+
+def create_essay_chain(checkpointed: bool = False):
+    from langgraph.graph import StateGraph, START, END
+    from langgraph.types import RetryPolicy
     builder = StateGraph(AgentState)
+    # Reruns only the failed node; the rest of the run is kept
+    retry = RetryPolicy(max_attempts=NODE_RETRY_ATTEMPTS, retry_on=should_retry_node)
 
-    builder.add_node("planner", plan_node)
-    builder.add_node("researcher_plan", research_plan_node)
-    builder.add_node("writer", generation_node)
-    builder.add_node("reflection", reflection_node)
-    builder.add_node("researcher_critique", research_critique_node)
+    builder.add_node("planner", graph_node("planner", plan_node, aplan_node), retry_policy=retry)
+    builder.add_node("researcher_plan", graph_node("researcher_plan", research_plan_node, aresearch_plan_node), retry_policy=retry)
+    builder.add_node("writer", graph_node("writer", generation_node, ageneration_node), retry_policy=retry)
+    builder.add_node("reflection", graph_node("reflection", reflection_node, areflection_node), retry_policy=retry)
+    builder.add_node("researcher_critique", graph_node("researcher_critique", research_critique_node, aresearch_critique_node), retry_policy=retry)
 
     # Add edges
-    builder.add_edge("planner", "researcher_plan")
-    builder.add_edge("researcher_plan", "writer")
-    builder.add_edge("writer", "reflection")
-    builder.add_edge("reflection", "researcher_critique")
+    # Planning and initial research only need the task, so they run as
+    # parallel branches and join before the first draft. They write
+    # disjoint keys, and content/queries have append reducers.
+    builder.add_edge(START, "planner")
+    builder.add_edge(START, "researcher_plan")
+    builder.add_edge(["planner", "researcher_plan"], "writer")
+    builder.add_conditional_edges("writer", should_continue, {END: END, "reflect": "reflection"})
+    builder.add_conditional_edges("reflection", route_after_reflection, {"research": "researcher_critique", "write": "writer"})
     builder.add_edge("researcher_critique", "writer")
-    builder.add_edge("writer", END, should_continue)
 
     # Build the chain
-    chain = builder.compile(checkpointer=memory)
+    chain = builder.compile(checkpointer=checkpointer.get() if checkpointed else None)
     
     return chain
 
+# Compiled once per process and shared by every request. Only runs with a
+# caller-supplied thread id are checkpointed: an anonymous thread could
+# never be resumed, and its checkpoints would only pile up.
+_essay_chains = {}
+_essay_chain_lock = threading.Lock()
+
+def get_essay_chain(checkpointed: bool = False):
+    chain = _essay_chains.get(checkpointed)
+    if chain is None:
+        with _essay_chain_lock:
+            chain = _essay_chains.get(checkpointed)
+            if chain is None:
+                chain = _essay_chains[checkpointed] = create_essay_chain(checkpointed)
+    return chain
+
+def invalidate_essay_chain():
+    # Call after changing prompts, the checkpointer or the graph wiring; the next
+    # get_essay_chain() recompiles
+    with _essay_chain_lock:
+        _essay_chains.clear()
+
+def essay_config(thread_id: str = None) -> Dict:
+    if thread_id is None or checkpointer.get() is None:
+        return {}
+    return {"configurable": {"thread_id": thread_id}}
+
+def _essay_run(thread_id: str = None):
+    # (chain, config, options) for one run; durability only applies to a
+    # checkpointed chain
+    config = essay_config(thread_id)
+    if not config:
+        return get_essay_chain(), config, {}
+    return get_essay_chain(checkpointed=True), config, {"durability": CHECKPOINT_DURABILITY}
+
+# Identical essays requested at the same time (e.g. the example prompts)
+# run once and every requester gets the result. Runs with a thread_id are
+# never shared: they own that thread's checkpoints.
+essay_flights = SingleFlight(on_join=lambda: metrics.record("essays_coalesced"))
+
+def essay_key(inputs: Dict) -> str:
+    task = " ".join(str(inputs.get("task", "")).lower().split())
+    return json.dumps({**inputs, "task": task}, sort_keys=True, default=str)
+
+def _invoke_essay(inputs: Dict, thread_id: str = None, resume: bool = False) -> Dict:
+    chain, config, options = _essay_run(thread_id)
+    if resume and config:
+        # A finished thread is returned as is: rerunning it would append its
+        # content and queries a second time
+        state = chain.get_state(config)
+        if state.next:
+            inputs = None
+        elif state.values:
+            return state.values
+    return chain.invoke(inputs, config, **options)
+
+def invoke_essay(inputs: Dict, thread_id: str = None, resume: bool = False) -> Dict:
+    # resume=True continues an earlier run of the same thread_id that
+    # stopped part-way, instead of starting over. Coalesced callers share
+    # one result dict; copy it before changing it.
+    if thread_id is None:
+        return essay_flights.do(essay_key(inputs), _invoke_essay, inputs)
+    return _invoke_essay(inputs, thread_id, resume)
+
+STREAM_MODES = ["updates", "messages", "values"]
+
+def _essay_events(mode: str, payload):
+    if mode == "updates":
+        for node, update in payload.items():
+            yield ("node", node, update)
+    elif mode == "messages":
+        chunk, metadata = payload
+        if metadata.get("langgraph_node") == "writer" and chunk.content:
+            yield ("token", chunk.content)
+
+async def _astream_essay(inputs: Dict, thread_id: str = None):
+    chain, config, options = _essay_run(thread_id)
+    state = None
+    async for mode, payload in chain.astream(inputs, config, stream_mode=STREAM_MODES, **options):
+        if mode == "values":
+            state = payload
+        for event in _essay_events(mode, payload):
+            yield event
+    yield ("result", state)
+
+async def astream_essay(inputs: Dict, thread_id: str = None):
+    # Yields ("node", name, update) as each node finishes, ("token", text)
+    # for every chunk the writer produces and finally ("result", state).
+    # Coalesced callers each receive every event of the shared run.
+    if thread_id is None:
+        events = essay_flights.astream(essay_key(inputs), _astream_essay, inputs)
+    else:
+        events = _astream_essay(inputs, thread_id)
+    async for event in events:
+        yield event
+
+def stream_essay(inputs: Dict, thread_id: str = None):
+    # Synchronous, uncoalesced astream_essay(), for worker processes and
+    # threads
+    chain, config, options = _essay_run(thread_id)
+    state = None
+    for mode, payload in chain.stream(inputs, config, stream_mode=STREAM_MODES, **options):
+        if mode == "values":
+            state = payload
+        yield from _essay_events(mode, payload)
+    yield ("result", state)
+
 if __name__ == "__main__":
-    chain = create_essay_chain()
-    
-    result = chain.invoke({
+    result = invoke_essay({
         "task": "Write about the importance of exercise",
         "content": [],
         "max_revisions": 1,
@@ -0,0 +1,151 @@
+import asyncio
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Iterator, List
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+from pydantic import PrivateAttr
+
+# Deterministic local stand-ins for ChatOpenAI and TavilyClient, used by the
+# offline tests and benchmarks. Latency is simulated with sleeps.
+
+
+def _topic(messages: List[BaseMessage]) -> str:
+    human = [m.content for m in messages if m.type == "human"]
+    words = re.findall(r"\w+", human[-1] if human else "")
+    return " ".join(words[:8]) or "the topic"
+
+
+class FakeChatModel(BaseChatModel):
+    latency: float = 0.0
+    essay_words: int = 400
+    chunk_words: int = 8
+    model_name: str = "fake-essay-model"
+    temperature: float = 0
+    _calls: int = PrivateAttr(default=0)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-essay-model"
+
+    @property
+    def calls(self) -> int:
+        return self._calls
+
+    def _count(self):
+        with self._lock:
+            self._calls += 1
+
+    def _reply(self, messages: List[BaseMessage]) -> str:
+        system = next((m.content for m in messages if m.type == "system"), "")
+        topic = _topic(messages)
+        if "outline" in system:
+            return f"1. Introduction to {topic}\n2. Background\n3. Analysis\n4. Counterpoints\n5. Conclusion"
+        if "grading" in system:
+            return f"Add more evidence and statistics about {topic}, and tighten the conclusion."
+        words = (f"{topic} matters for many reasons ").split()
+        return " ".join(words[i % len(words)] for i in range(self.essay_words))
+
+    def _message(self, text: str, messages: List[BaseMessage]) -> AIMessage:
+        prompt_tokens = sum(len(str(m.content)) for m in messages) // 4
+        completion_tokens = len(text) // 4
+        return AIMessage(content=text, usage_metadata={
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        })
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self._count()
+        time.sleep(self.latency)
+        text = self._reply(messages)
+        return ChatResult(generations=[ChatGeneration(message=self._message(text, messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self._count()
+        await asyncio.sleep(self.latency)
+        text = self._reply(messages)
+        return ChatResult(generations=[ChatGeneration(message=self._message(text, messages))])
+
+    def _chunks(self, text: str) -> List[str]:
+        words = text.split(" ")
+        return [" ".join(words[i:i + self.chunk_words]) + " "
+                for i in range(0, len(words), self.chunk_words)]
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        self._count()
+        time.sleep(self.latency)
+        for piece in self._chunks(self._reply(messages)):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        self._count()
+        await asyncio.sleep(self.latency)
+        for piece in self._chunks(self._reply(messages)):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                await run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+    def with_structured_output(self, schema, *, include_raw: bool = False, **kwargs):
+        # Only the essay writer's Queries schema is supported
+        def parse(messages):
+            raw = self._message("", messages)
+            topic = _topic(messages)
+            parsed = schema(queries=[f"{topic} facts", f"{topic} statistics", f"{topic} history"])
+            if include_raw:
+                return {"raw": raw, "parsed": parsed, "parsing_error": None}
+            return parsed
+
+        def invoke(messages):
+            self._count()
+            time.sleep(self.latency)
+            return parse(messages)
+
+        async def ainvoke(messages):
+            self._count()
+            await asyncio.sleep(self.latency)
+            return parse(messages)
+
+        return RunnableLambda(invoke, afunc=ainvoke)
+
+
+class FakeSearchClient:
+    # Sync TavilyClient stand-in; queries in slow_queries take 10x latency
+    def __init__(self, latency: float = 0.0, slow_queries=(), snippet_words: int = 60):
+        self.latency = latency
+        self.slow_queries = set(slow_queries)
+        self.snippet_words = snippet_words
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _delay(self, query: str) -> float:
+        with self._lock:
+            self.calls += 1
+        return self.latency * (10 if query in self.slow_queries else 1)
+
+    def _response(self, query: str, max_results: int) -> dict:
+        filler = " ".join(f"{query} detail" for _ in range(self.snippet_words // 3))
+        return {"query": query, "results": [
+            {"title": f"{query} {i}", "url": f"https://example.com/{i}",
+             "content": f"{query} result {i}" + (f". {filler}" if self.snippet_words else "")}
+            for i in range(max_results)
+        ]}
+
+    def search(self, query: str, max_results: int = 5, **kwargs) -> dict:
+        time.sleep(self._delay(query))
+        return self._response(query, max_results)
+
+
+class FakeAsyncSearchClient(FakeSearchClient):
+    async def search(self, query: str, max_results: int = 5, **kwargs) -> dict:
+        await asyncio.sleep(self._delay(query))
+        return self._response(query, max_results)
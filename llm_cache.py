@@ -0,0 +1,122 @@
+import hashlib
+import json
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+
+def hashed_embedding(text: str, dims: int = 1024) -> Dict[int, float]:
+    # Local bag-of-words embedding (unigrams + bigrams, feature hashing),
+    # L2-normalised and kept sparse so cosine similarity is a dot product
+    words = re.findall(r"\w+", text.lower())
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    vector: Dict[int, float] = {}
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+        index = int.from_bytes(digest, "little") % dims
+        vector[index] = vector.get(index, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    return {i: v / norm for i, v in vector.items()} if norm else {}
+
+
+def cosine(a: Dict[int, float], b: Dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(i, 0.0) for i, v in a.items())
+
+
+def response_tokens(response) -> int:
+    usage = getattr(response, "usage_metadata", None) or {}
+    if usage.get("total_tokens"):
+        return usage["total_tokens"]
+    metadata = getattr(response, "response_metadata", None) or {}
+    return metadata.get("token_usage", {}).get("total_tokens", 0)
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 1000, similarity_threshold: Optional[float] = None,
+                 embed: Callable[[str], Dict[int, float]] = hashed_embedding):
+        self.max_entries = max_entries
+        # None disables the similarity tier; only exact prompts then hit
+        self.similarity_threshold = similarity_threshold
+        self.embed = embed
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _split(messages: List) -> tuple:
+        # System prompts must match exactly; only the user side is compared
+        # for similarity
+        context = [(m.type, m.content) for m in messages if m.type != "human"]
+        text = "\n".join(m.content for m in messages if m.type == "human")
+        return context, text
+
+    def _keys(self, messages: List, namespace: str) -> tuple:
+        context, text = self._split(messages)
+        scope = hashlib.sha256(json.dumps([namespace, context]).encode()).hexdigest()
+        payload = [(m.type, m.content) for m in messages]
+        key = hashlib.sha256(json.dumps([namespace, payload]).encode()).hexdigest()
+        return scope, key, text
+
+    def lookup(self, messages: List, namespace: str = ""):
+        scope, key, text = self._keys(messages, namespace)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                self.saved_tokens += response_tokens(entry[2])
+                return entry[2]
+
+        if self.similarity_threshold is not None:
+            vector = self.embed(text)
+            with self._lock:
+                best_key, best_score = None, self.similarity_threshold
+                for candidate_key, (candidate_scope, candidate_vector, _) in self._entries.items():
+                    if candidate_scope != scope:
+                        continue
+                    score = cosine(vector, candidate_vector)
+                    if score >= best_score:
+                        best_key, best_score = candidate_key, score
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    response = self._entries[best_key][2]
+                    self.similar_hits += 1
+                    self.saved_tokens += response_tokens(response)
+                    return response
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def store(self, messages: List, response, namespace: str = ""):
+        scope, key, text = self._keys(messages, namespace)
+        vector = self.embed(text) if self.similarity_threshold is not None else None
+        with self._lock:
+            self._entries[key] = (scope, vector, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits = self.exact_hits + self.similar_hits
+            lookups = hits + self.misses
+            return {
+                'exact_hits': self.exact_hits,
+                'similar_hits': self.similar_hits,
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'saved_tokens': self.saved_tokens,
+                'entries': len(self._entries)
+            }
@@ -0,0 +1,189 @@
+import argparse
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Graph node currently executing; external calls are attributed to it
+current_node = contextvars.ContextVar("current_node", default="-")
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# metric -> (Prometheus name, help text). Metrics ending in "seconds" are
+# timings and rendered as summaries; the rest are counters.
+METRICS = {
+    "node_seconds": ("essay_node_seconds", "Wall time per graph node"),
+    "llm_seconds": ("essay_llm_call_seconds", "Wall time per model call"),
+    "search_seconds": ("essay_search_call_seconds", "Wall time per search call"),
+    "prompt_tokens": ("essay_prompt_tokens_total", "Prompt tokens sent to the model"),
+    "completion_tokens": ("essay_completion_tokens_total", "Completion tokens returned by the model"),
+    "llm_calls": ("essay_llm_calls_total", "Model calls made"),
+    "llm_cache_hits": ("essay_llm_cache_hits_total", "Model calls served from the response cache"),
+    "searches": ("essay_searches_total", "Search queries issued"),
+    "search_cache_hits": ("essay_search_cache_hits_total", "Search queries served from the search cache"),
+    "search_timeouts": ("essay_search_timeouts_total", "Search queries dropped for exceeding SEARCH_TIMEOUT"),
+    "rate_limit_seconds": ("essay_rate_limit_wait_seconds", "Time calls waited for provider rate limits"),
+    "retries": ("essay_call_retries_total", "Provider calls retried after a 429 or transient error"),
+    "essays_coalesced": ("essay_coalesced_requests_total", "Essay requests that joined an identical run in flight"),
+}
+
+
+def quantile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def summarize(samples: Iterable[Tuple[str, str, float]]) -> Dict[Tuple[str, str], Dict]:
+    grouped = defaultdict(list)
+    for node, metric, value in samples:
+        grouped[(node, metric)].append(value)
+    summary = {}
+    for key, values in grouped.items():
+        values.sort()
+        summary[key] = {
+            "count": len(values),
+            "sum": sum(values),
+            **{q: quantile(values, q) for q in QUANTILES}
+        }
+    return summary
+
+
+def render_prometheus(summary: Dict[Tuple[str, str], Dict]) -> str:
+    lines = []
+    for metric, (name, help_text) in METRICS.items():
+        keys = sorted(key for key in summary if key[1] == metric)
+        if not keys:
+            continue
+        is_timing = metric.endswith("seconds")
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {'summary' if is_timing else 'counter'}")
+        for node, _ in keys:
+            stats = summary[(node, metric)]
+            if is_timing:
+                for q in QUANTILES:
+                    lines.append(f'{name}{{node="{node}",quantile="{q}"}} {stats[q]:.6f}')
+                lines.append(f'{name}_sum{{node="{node}"}} {stats["sum"]:.6f}')
+                lines.append(f'{name}_count{{node="{node}"}} {stats["count"]}')
+            else:
+                lines.append(f'{name}{{node="{node}"}} {stats["sum"]:g}')
+    return "\n".join(lines) + "\n"
+
+
+class MetricsRegistry:
+    # Keeps a sliding window of samples per (node, metric) for percentiles
+    # and buffers every sample for an optional sink, e.g.
+    # MetricsStore.record, which persists them across processes
+    def __init__(self, window: int = 2048, flush_every: int = 200):
+        self.window = window
+        self.flush_every = flush_every
+        self.sink: Optional[Callable[[List[Tuple[float, str, str, float]]], None]] = None
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+        self._totals = defaultdict(lambda: [0, 0.0])  # all-time count and sum
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def record(self, metric: str, value: float = 1, node: str = None):
+        node = node or current_node.get()
+        with self._lock:
+            self._samples[(node, metric)].append(value)
+            totals = self._totals[(node, metric)]
+            totals[0] += 1
+            totals[1] += value
+            if self.sink is None:
+                return
+            self._pending.append((time.time(), node, metric, value))
+            should_flush = len(self._pending) >= self.flush_every
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if pending and self.sink is not None:
+            self.sink(pending)
+
+    def record_llm_usage(self, response):
+        usage = getattr(response, "usage_metadata", None) or {}
+        if not usage:
+            usage = (getattr(response, "response_metadata", None) or {}).get("token_usage", {})
+            usage = {"input_tokens": usage.get("prompt_tokens", 0),
+                     "output_tokens": usage.get("completion_tokens", 0)}
+        self.record("prompt_tokens", usage.get("input_tokens", 0))
+        self.record("completion_tokens", usage.get("output_tokens", 0))
+
+    @contextmanager
+    def timer(self, metric: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(metric, time.perf_counter() - start)
+
+    def summary(self) -> Dict[Tuple[str, str], Dict]:
+        # Quantiles over the window; count and sum over the process lifetime
+        with self._lock:
+            samples = [(node, metric, value)
+                       for (node, metric), values in self._samples.items()
+                       for value in values]
+            totals = {key: tuple(value) for key, value in self._totals.items()}
+        summary = summarize(samples)
+        for key, (count, total) in totals.items():
+            summary[key]["count"] = count
+            summary[key]["sum"] = total
+        return summary
+
+    def render_prometheus(self) -> str:
+        return render_prometheus(self.summary())
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._totals.clear()
+            self._pending = []
+
+
+registry = MetricsRegistry()
+
+
+def instrument(node: str, fn: Callable) -> Callable:
+    # Times a graph node and attributes the calls it makes to it
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            token = current_node.set(node)
+            try:
+                with registry.timer("node_seconds"):
+                    return await fn(*args, **kwargs)
+            finally:
+                current_node.reset(token)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = current_node.set(node)
+        try:
+            with registry.timer("node_seconds"):
+                return fn(*args, **kwargs)
+        finally:
+            current_node.reset(token)
+    return wrapper
+
+
+if __name__ == "__main__":
+    # Prometheus-style summary of the metrics persisted by every process
+    from metrics_store import MetricsStore
+
+    parser = argparse.ArgumentParser(description="Summarize essay pipeline metrics")
+    parser.add_argument("--db", default="metrics.db")
+    parser.add_argument("--since", type=float, default=None,
+                        help="only samples from the last N seconds")
+    args = parser.parse_args()
+
+    store = MetricsStore(args.db)
+    since = time.time() - args.since if args.since else None
+    print(render_prometheus(summarize(store.get(since))), end="")
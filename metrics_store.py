@@ -0,0 +1,66 @@
+import time
+from typing import List, Tuple
+
+from chat_db import ConnectionManager
+
+
+class MetricsStore:
+    # Per-node metrics persisted by every process (app.py, the serving.py
+    # workers) in a SQLite file of their own, so sample writes never contend
+    # with chat_history.db. Samples older than retention_seconds are pruned
+    # as new ones arrive.
+    def __init__(self, db_path="metrics.db", retention_seconds=7 * 24 * 60 * 60):
+        self.db_path = db_path
+        self.retention_seconds = retention_seconds
+        self.connections = ConnectionManager(db_path)
+        self.init_db()
+
+    def init_db(self):
+        with self.connections.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS node_metrics (
+                    recorded_at REAL NOT NULL,
+                    node TEXT NOT NULL,
+                    metric TEXT NOT NULL,
+                    value REAL NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_node_metrics_recorded_at
+                ON node_metrics (recorded_at)
+            ''')
+            conn.commit()
+
+    def record(self, rows: List[Tuple[float, str, str, float]]):
+        # rows of (recorded_at, node, metric, value), as buffered by metrics.py
+        with self.connections.connection() as conn:
+            conn.executemany('''
+                INSERT INTO node_metrics (recorded_at, node, metric, value)
+                VALUES (?, ?, ?, ?)
+            ''', rows)
+            self._prune(conn)
+            conn.commit()
+
+    def prune(self) -> int:
+        with self.connections.connection() as conn:
+            removed = self._prune(conn)
+            conn.commit()
+        return removed
+
+    def _prune(self, conn) -> int:
+        cursor = conn.execute('DELETE FROM node_metrics WHERE recorded_at < ?',
+                              (time.time() - self.retention_seconds,))
+        return cursor.rowcount
+
+    def get(self, since: float = None) -> List[Tuple[str, str, float]]:
+        with self.connections.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT node, metric, value FROM node_metrics
+                WHERE recorded_at >= ?
+            ''', (since or 0,))
+            return cursor.fetchall()
+
+    def close(self):
+        self.connections.close_all()
@@ -0,0 +1,41 @@
+import threading
+from contextlib import contextmanager
+
+_UNSET = object()
+
+class Provider:
+    # A lazily built, process-wide value (model, search client, checkpointer).
+    # The factory runs on the first get(); set() and override() replace the
+    # value, e.g. with fakes in tests and benchmarks.
+    def __init__(self, factory):
+        self.factory = factory
+        self._value = _UNSET
+        self._lock = threading.Lock()
+
+    def get(self):
+        value = self._value
+        if value is _UNSET:
+            with self._lock:
+                if self._value is _UNSET:
+                    self._value = self.factory()
+                value = self._value
+        return value
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def reset(self):
+        # The next get() builds a fresh value
+        self.set(_UNSET)
+
+    @contextmanager
+    def override(self, value):
+        with self._lock:
+            previous = self._value
+            self._value = value
+        try:
+            yield value
+        finally:
+            with self._lock:
+                self._value = previous
@@ -0,0 +1,109 @@
+import functools
+import hashlib
+import math
+import re
+import zlib
+from collections import Counter
+from typing import List
+
+_WORD = re.compile(r"\w+")
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding():
+    # Loaded on first use; building the BPE tables is slow
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:  # tiktoken missing or its encoding unavailable offline
+        return None
+
+
+def estimate_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return max(1, len(text) // 4)
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+@functools.lru_cache(maxsize=4096)
+def shingles(text: str) -> frozenset:
+    # Hashed word 3-shingles, for near-duplicate detection. Cached because
+    # the same snippets are compared again every revision.
+    words = _words(text)
+    return frozenset(zlib.crc32(" ".join(words[i:i + 3]).encode())
+                     for i in range(max(1, len(words) - 2)))
+
+
+def dedup_snippets(snippets: List[str], min_similarity: float = 0.8) -> List[str]:
+    # Drops exact repeats (after whitespace/case normalisation) and snippets
+    # sharing at least min_similarity (Jaccard) of their shingles with one
+    # already kept
+    seen_hashes = set()
+    kept_shingles = []
+    unique = []
+    for snippet in snippets:
+        digest = hashlib.sha1(" ".join(_words(snippet)).encode()).hexdigest()
+        if digest in seen_hashes:
+            continue
+        current = shingles(snippet)
+        if any(_similar(current, other, min_similarity) for other in kept_shingles):
+            continue
+        seen_hashes.add(digest)
+        kept_shingles.append(current)
+        unique.append(snippet)
+    return unique
+
+
+def _similar(a: frozenset, b: frozenset, min_similarity: float) -> bool:
+    # Sets whose sizes differ too much cannot reach min_similarity
+    if min(len(a), len(b)) < min_similarity * max(len(a), len(b)):
+        return False
+    common = len(a & b)
+    return common >= min_similarity * (len(a) + len(b) - common)
+
+
+def rank_snippets(snippets: List[str], query: str, k1: float = 1.5, b: float = 0.75) -> List[str]:
+    # BM25 with the snippets themselves as the corpus
+    if not snippets:
+        return []
+    documents = [_words(snippet) for snippet in snippets]
+    average_length = sum(len(d) for d in documents) / len(documents) or 1
+    document_frequency = Counter(term for d in documents for term in set(d))
+    terms = set(_words(query))
+
+    def score(document):
+        counts = Counter(document)
+        total = 0.0
+        for term in terms:
+            if term not in counts:
+                continue
+            df = document_frequency[term]
+            idf = math.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+            tf = counts[term]
+            total += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(document) / average_length))
+        return total
+
+    scores = [score(d) for d in documents]
+    # Stable: ties keep their research order
+    order = sorted(range(len(snippets)), key=lambda i: -scores[i])
+    return [snippets[i] for i in order]
+
+
+def pack_snippets(snippets: List[str], token_budget: int) -> List[str]:
+    packed, used = [], 0
+    for snippet in snippets:
+        tokens = estimate_tokens(snippet)
+        if used + tokens > token_budget:
+            continue
+        packed.append(snippet)
+        used += tokens
+    return packed
+
+
+def build_context(snippets: List[str], query: str, token_budget: int) -> List[str]:
+    return pack_snippets(rank_snippets(dedup_snippets(snippets), query), token_budget)
@@ -0,0 +1,228 @@
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from metrics import registry as metrics
+
+# Outbound call scheduling for the model and search providers: token buckets
+# for requests/min and tokens/min, interactive work ahead of batch work, and
+# jittered exponential backoff on 429s and transient errors.
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+# Priority of the calls made in this context; batch.py runs under BATCH
+current_priority = contextvars.ContextVar("essay_call_priority", default=INTERACTIVE)
+
+# HTTP statuses worth retrying, and exception class names (matched along the
+# MRO) of the openai, httpx and requests connection and timeout errors
+RETRYABLE_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+TRANSIENT_ERRORS = {"APIConnectionError", "APITimeoutError", "TransportError", "ConnectionError",
+                    "Timeout", "TimeoutError"}
+# Exceptions that stand for a 429 but carry no status, e.g. tavily's
+RATE_LIMIT_ERRORS = {"UsageLimitExceededError"}
+
+
+class DeadlineExceeded(Exception):
+    # Raised by RateLimiter.call()/acall() when waiting for capacity or a
+    # backoff would run past the caller's deadline
+    pass
+
+
+@contextmanager
+def priority(level: str):
+    token = current_priority.set(level)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+def status_code(error: BaseException) -> Optional[int]:
+    for source in (error, getattr(error, "response", None)):
+        for attr in ("status_code", "status", "code"):
+            value = getattr(source, attr, None)
+            if isinstance(value, int):
+                return value
+    if any(cls.__name__ in RATE_LIMIT_ERRORS for cls in type(error).__mro__):
+        return 429
+    return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    status = status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__)
+
+
+def retries_exhausted(error: BaseException) -> bool:
+    # Set on errors a RateLimiter stopped retrying; retrying them again
+    # further up (e.g. a LangGraph RetryPolicy) would multiply the attempts
+    return getattr(error, "exhausted_retries", False)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    # Seconds from a Retry-After header, when the provider sent one
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None) or {}
+    seconds = headers.get("retry-after") or headers.get("Retry-After")
+    if seconds is None:
+        seconds = getattr(error, "retry_after_seconds", None)
+    try:
+        return max(0.0, float(seconds))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    # Refills at per_minute / 60 per second up to burst_seconds' worth.
+    # reserve() takes the amount at once, going into debt if need be, and
+    # returns how long the caller must wait before spending it, so concurrent
+    # callers queue up in arrival order.
+    def __init__(self, per_minute: float, burst_seconds: float = 10.0):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, keep: float = 0.0) -> float:
+        # keep: fraction of capacity that must remain afterwards. Batch
+        # callers keep some back, so interactive ones rarely wait behind them.
+        with self._lock:
+            self._refill()
+            self.level -= amount
+            return max(0.0, (keep * self.capacity - self.level) / self.rate)
+
+    def refund(self, amount: float):
+        # Negative amounts charge more, e.g. when a call used more tokens
+        # than estimated
+        with self._lock:
+            self._refill()
+            self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    # Shared by every call to one provider in this process. call()/acall()
+    # wait for capacity, run the call and retry it with backoff when it fails
+    # with a retryable error. A 429 holds back every caller, not just the
+    # one that got it. With a deadline (time.monotonic()), a call fails with
+    # DeadlineExceeded instead of waiting past it.
+    def __init__(self, name: str, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 batch_reserve: float = 0.2, max_attempts: int = 5, base_delay: float = 1.0,
+                 max_delay: float = 30.0):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.batch_reserve = batch_reserve
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._blocked_until = 0.0
+
+    def scale(self, fraction: float):
+        # Gives this process a share of the limits, e.g. 1 / workers
+        self.requests = TokenBucket(self.requests_per_minute * fraction) if self.requests_per_minute else None
+        self.tokens = TokenBucket(self.tokens_per_minute * fraction) if self.tokens_per_minute else None
+
+    def reserve(self, tokens: float = 0) -> float:
+        keep = self.batch_reserve if current_priority.get() == BATCH else 0.0
+        wait = max(0.0, self._blocked_until - time.monotonic())
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1, keep))
+        if self.tokens is not None and tokens:
+            wait = max(wait, self.tokens.reserve(tokens, keep))
+        if wait:
+            metrics.record("rate_limit_seconds", wait)
+        return wait
+
+    def release(self, tokens: float = 0):
+        # Returns a reservation that was never spent
+        if self.requests is not None:
+            self.requests.refund(1)
+        if self.tokens is not None and tokens:
+            self.tokens.refund(tokens)
+
+    def settle(self, estimated: float, used: Optional[float]):
+        # used=None when the provider did not report usage
+        if self.tokens is not None and used is not None:
+            self.tokens.refund(estimated - used)
+
+    def backoff(self, attempt: int, error: BaseException) -> float:
+        # Full jitter: uniform in [0, base * 2^attempt], capped
+        delay = retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if status_code(error) == 429:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+        return delay
+
+    def _admit(self, tokens: float, deadline: Optional[float]) -> float:
+        wait = self.reserve(tokens)
+        if deadline is not None and time.monotonic() + wait > deadline:
+            self.release(tokens)
+            raise DeadlineExceeded(f"{self.name}: no capacity within the deadline")
+        return wait
+
+    def _retry_delay(self, attempt: int, error: Exception, deadline: Optional[float]) -> Optional[float]:
+        # Seconds to wait before the next attempt, or None to re-raise error
+        if not is_retryable(error):
+            return None
+        delay = self.backoff(attempt, error)
+        if deadline is not None and time.monotonic() + delay > deadline:
+            error.exhausted_retries = True
+            raise DeadlineExceeded(f"{self.name}: retry would run past the deadline") from error
+        if attempt + 1 == self.max_attempts:
+            error.exhausted_retries = True
+            return None
+        metrics.record("retries")
+        return delay
+
+    def call(self, fn: Callable, *args, tokens: float = 0,
+             usage: Optional[Callable[..., Optional[float]]] = None,
+             deadline: Optional[float] = None, **kwargs):
+        # tokens is the estimated cost; usage(result) the actual one
+        for attempt in range(self.max_attempts):
+            time.sleep(self._admit(tokens, deadline))
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                self.settle(tokens, 0)
+                delay = self._retry_delay(attempt, e, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            if usage is not None:
+                self.settle(tokens, usage(result))
+            return result
+
+    async def acall(self, fn: Callable, *args, tokens: float = 0,
+                    usage: Optional[Callable[..., Optional[float]]] = None,
+                    deadline: Optional[float] = None, **kwargs):
+        for attempt in range(self.max_attempts):
+            await asyncio.sleep(self._admit(tokens, deadline))
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                self.settle(tokens, 0)
+                delay = self._retry_delay(attempt, e, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            if usage is not None:
+                self.settle(tokens, usage(result))
+            return result
@@ -0,0 +1,124 @@
+import json
+import threading
+import time
+from typing import Dict, Optional
+
+from chat_db import ConnectionManager
+
+
+class SearchCache:
+    def __init__(self, db_path="search_cache.db", ttl_seconds=24 * 60 * 60, max_entries=10000):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+        self.connections = ConnectionManager(db_path)
+        self.init_db()
+
+    def init_db(self):
+        with self.connections.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS search_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    query TEXT NOT NULL,
+                    max_results INTEGER NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_search_cache_last_access
+                ON search_cache (last_access)
+            ''')
+            conn.commit()
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        # "Climate  change?" and "climate change" share one entry. Other
+        # punctuation is kept: "C++ history" and "C# history" differ.
+        return " ".join(query.lower().split()).rstrip("?!. ")
+
+    def cache_key(self, query: str, max_results: int) -> str:
+        return f"{self.normalize(query)}|{max_results}"
+
+    def _count(self, hit: bool):
+        with self._counter_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, query: str, max_results: int) -> Optional[Dict]:
+        key = self.cache_key(query, max_results)
+        now = time.time()
+        with self.connections.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT response, created_at FROM search_cache WHERE cache_key = ?
+            ''', (key,))
+            row = cursor.fetchone()
+            if row is None:
+                self._count(hit=False)
+                return None
+            response, created_at = row
+            if now - created_at > self.ttl_seconds:
+                cursor.execute('DELETE FROM search_cache WHERE cache_key = ?', (key,))
+                conn.commit()
+                self._count(hit=False)
+                return None
+            cursor.execute('''
+                UPDATE search_cache SET last_access = ? WHERE cache_key = ?
+            ''', (now, key))
+            conn.commit()
+        self._count(hit=True)
+        return json.loads(response)
+
+    def put(self, query: str, max_results: int, response: Dict):
+        now = time.time()
+        with self.connections.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO search_cache
+                (cache_key, query, max_results, response, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (self.cache_key(query, max_results), query, max_results,
+                  json.dumps(response), now, now))
+
+            # Drop expired rows, then the least recently used beyond the cap
+            cursor.execute('''
+                DELETE FROM search_cache WHERE created_at < ?
+            ''', (now - self.ttl_seconds,))
+            cursor.execute('SELECT COUNT(*) FROM search_cache')
+            overflow = cursor.fetchone()[0] - self.max_entries
+            if overflow > 0:
+                cursor.execute('''
+                    DELETE FROM search_cache WHERE cache_key IN (
+                        SELECT cache_key FROM search_cache
+                        ORDER BY last_access ASC
+                        LIMIT ?
+                    )
+                ''', (overflow,))
+            conn.commit()
+
+    def clear(self):
+        with self.connections.connection() as conn:
+            conn.execute('DELETE FROM search_cache')
+            conn.commit()
+
+    def close(self):
+        self.connections.close_all()
+
+    def stats(self) -> Dict:
+        with self.connections.connection() as conn:
+            entries = conn.execute('SELECT COUNT(*) FROM search_cache').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries
+        }
@@ -0,0 +1,143 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import queue
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, Optional
+
+from metrics_store import MetricsStore
+
+# Production serving: one Gradio process owns the port, the chat database
+# writes and the sessions, while essays are generated in a pool of worker
+# processes so graph execution scales with cores instead of one GIL.
+#
+#   python serving.py --workers 4 --port 7860
+#
+# Workers share state only through SQLite (metrics.db, search_cache.db,
+# and checkpoints.db with ESSAY_CHECKPOINTER=sqlite).
+
+# Seconds between checks that a worker is still running its essay
+EVENT_POLL_SECONDS = 0.5
+# Requests handled at once per worker process, unless --concurrency is given
+REQUESTS_PER_WORKER = 4
+
+_metrics_store = None
+
+
+def _init_worker(metrics_path: str, setup: Optional[Callable[[], None]], workers: int):
+    global _metrics_store
+    import essay_writer
+    from metrics import registry as metrics
+
+    if setup is not None:
+        setup()
+    # Provider rate limits are split evenly between the workers
+    essay_writer.openai_limiter.scale(1 / workers)
+    essay_writer.tavily_limiter.scale(1 / workers)
+    _metrics_store = MetricsStore(metrics_path)
+    metrics.sink = _metrics_store.record
+    essay_writer.get_essay_chain()
+
+
+def _generate(inputs: Dict, events) -> None:
+    import essay_writer
+    from metrics import registry as metrics
+
+    try:
+        for event in essay_writer.stream_essay(inputs):
+            events.put(event)
+        metrics.flush()
+    finally:
+        events.put(None)
+
+
+def _ready(barrier) -> int:
+    # Holds each worker until all have started, so every worker gets one
+    barrier.wait()
+    return os.getpid()
+
+
+class EssayWorkerPool:
+    def __init__(self, workers: int, metrics_path: str, setup: Optional[Callable[[], None]] = None,
+                 concurrency: Optional[int] = None):
+        # setup, a module-level function, runs first in every worker, e.g.
+        # to swap in other clients before the graph is compiled
+        context = multiprocessing.get_context("spawn")
+        self.workers = workers
+        self.concurrency = concurrency or REQUESTS_PER_WORKER * workers
+        # Each essay in flight blocks a thread while it waits for events.
+        # They get a pool of their own, sized to the request limit, so they
+        # never starve asyncio's default executor, which the front end's
+        # database calls use.
+        self._relay = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="essay-relay")
+        self._manager = context.Manager()
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=context,
+            initializer=_init_worker, initargs=(metrics_path, setup, workers)
+        )
+
+    def warm(self):
+        # Start every worker and compile its graph before the first request
+        barrier = self._manager.Barrier(self.workers)
+        futures = [self._pool.submit(_ready, barrier) for _ in range(self.workers)]
+        return {future.result() for future in futures}
+
+    async def astream_essay(self, inputs: Dict) -> AsyncIterator:
+        # Same events as essay_writer.astream_essay(), relayed from a worker;
+        # identical requests in flight share one worker run
+        import essay_writer
+
+        async for event in essay_writer.essay_flights.astream(
+                essay_writer.essay_key(inputs), self._astream_essay, inputs):
+            yield event
+
+    async def _astream_essay(self, inputs: Dict) -> AsyncIterator:
+        loop = asyncio.get_running_loop()
+        events = self._manager.Queue()
+        future = loop.run_in_executor(self._pool, _generate, inputs, events)
+        while True:
+            try:
+                event = await loop.run_in_executor(self._relay, events.get, True, EVENT_POLL_SECONDS)
+            except queue.Empty:
+                if future.done():
+                    break
+                continue
+            if event is None:
+                break
+            yield event
+        # Re-raises whatever failed in the worker
+        await future
+
+    def close(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._relay.shutdown(wait=True, cancel_futures=True)
+        self._manager.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the essay writer with a pool of worker processes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=7860)
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help=f"requests handled at once (default: {REQUESTS_PER_WORKER} per worker)")
+    args = parser.parse_args()
+
+    # Imported here so worker processes, which re-import this module, never
+    # load gradio or open the front end's write-behind database
+    import app
+
+    pool = EssayWorkerPool(args.workers, app.METRICS_DB_PATH, concurrency=args.concurrency)
+    pool.warm()
+    app.essay_source = pool.astream_essay
+    try:
+        demo = app.create_interface()
+        demo.queue(default_concurrency_limit=pool.concurrency)
+        demo.launch(server_name=args.host, server_port=args.port)
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,79 @@
-from test import (
+import asyncio
+import contextlib
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import essay_writer
+from essay_writer import (
     AgentState,
     plan_node,
     research_plan_node,
     generation_node,
     reflection_node,
-    research_critique_node
+    research_critique_node,
+    search_queries,
+    asearch_queries
+)
+from search_cache import SearchCache
+from llm_cache import ResponseCache
+from research_context import build_context, dedup_snippets, estimate_tokens
+from metrics import MetricsRegistry, instrument, render_prometheus
+from metrics_store import MetricsStore
+import metrics
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from fakes import FakeAsyncSearchClient, FakeChatModel, FakeSearchClient
+import chat_db
+from chat_db import ChatDatabase
+import batch
+from checkpointing import BoundedMemorySaver
+from serving import EssayWorkerPool
+from scheduler import BATCH, RateLimiter, is_retryable, priority
+
+# Tests against the real OpenAI and Tavily APIs; keys may come from .env,
+# which importing essay_writer has loaded
+live = pytest.mark.skipif(
+    not (os.environ.get("OPENAI_API_KEY") and os.environ.get("TAVILY_API_KEY")),
+    reason="needs OPENAI_API_KEY and TAVILY_API_KEY"
 )
 
+@pytest.fixture
+def provide():
+    # provide(essay_writer.chat_model, fake) overrides a provider until the
+    # test ends
+    with contextlib.ExitStack() as stack:
+        yield lambda provider, value: stack.enter_context(provider.override(value))
+
+@pytest.fixture(autouse=True)
+def isolated_search_cache(tmp_path, provide):
+    provide(essay_writer.search_cache, SearchCache(str(tmp_path / "search_cache.db")))
+
+@pytest.fixture
+def offline_pipeline(provide, monkeypatch):
+    # Fake model and search backends, no checkpointer, fresh compiled chain
+    model = FakeChatModel()
+    search = FakeSearchClient(snippet_words=0)
+    provide(essay_writer.chat_model, model)
+    provide(essay_writer.search_client, search)
+    provide(essay_writer.async_search_client, FakeAsyncSearchClient(snippet_words=0))
+    provide(essay_writer.checkpointer, None)
+    monkeypatch.setattr(essay_writer, "response_cache", ResponseCache())
+    essay_writer.invalidate_essay_chain()
+    yield model, search
+    essay_writer.invalidate_essay_chain()
+
+@live
 def test_plan_node():
     # Create a sample state using the same AgentState from test.py
     test_state = AgentState(
@@ -35,6 +102,7 @@ def test_plan_node():
     print("\nGenerated plan:")
     print(result["plan"])
 
+@live
 def test_research_plan_node():
     # Create a sample state using the same AgentState from test.py
     test_state = AgentState(
@@ -85,6 +153,7 @@ def test_research_plan_node():
         
         print("\n" + "=" * 80 + "\n")
 
+@live
 def test_generation_node():
     # Create a sample state with plan and content
     test_state = AgentState(
@@ -120,6 +189,7 @@ def test_generation_node():
     print(result["draft"])
     print("\nRevision number:", result["revision_number"])
 
+@live
 def test_reflection_node():
     # Create a sample state with a draft
     test_state = AgentState(
@@ -153,6 +223,7 @@ def test_reflection_node():
     print("-" * 50)
     print(result["critique"])
 
+@live
 def test_research_critique_node():
     # Create a sample state with a critique
     test_state = AgentState(
@@ -166,6 +237,8 @@ def test_research_critique_node():
         max_revisions=3,
         revision_number=1
     )
+    # Generated by the reflection node in the graph
+    test_state["critique_queries"] = essay_writer.critique_queries(test_state["critique"], [])
     
     # Call research_critique_node
     result = research_critique_node(test_state)
@@ -206,5 +279,609 @@ def test_research_critique_node():
         
         print("\n" + "=" * 80 + "\n")
 
+def test_search_queries_runs_concurrently(provide):
+    provide(essay_writer.search_client, FakeSearchClient(latency=0.2, snippet_words=0))
+    queries = ["first query", "second query", "third query"]
+
+    start = time.perf_counter()
+    content = search_queries(queries)
+    elapsed = time.perf_counter() - start
+
+    # Three 0.2s searches should cost about one search, not three
+    assert elapsed < 0.45, f"Searches look sequential ({elapsed:.2f}s)"
+    assert content == [f"{q} result {i}" for q in queries for i in range(2)]
+
+def test_search_queries_skips_timed_out_query(provide, monkeypatch):
+    provide(essay_writer.search_client, FakeSearchClient(latency=0.05, slow_queries={"slow query"}, snippet_words=0))
+    monkeypatch.setattr(essay_writer, "SEARCH_TIMEOUT", 0.2)
+    drops = metrics.registry.summary().get(("-", "search_timeouts"), {}).get("count", 0)
+
+    content = search_queries(["fast query", "slow query", "other query"])
+
+    assert content == [
+        "fast query result 0", "fast query result 1",
+        "other query result 0", "other query result 1"
+    ]
+    assert metrics.registry.summary()[("-", "search_timeouts")]["count"] == drops + 1
+
+def test_search_timeout_excludes_time_queued(provide, monkeypatch):
+    # Four essays share a one-thread pool: the last searches queue for about
+    # 0.35s but each runs in 0.05s, well inside the timeout
+    provide(essay_writer.search_client, FakeSearchClient(latency=0.05, snippet_words=0))
+    monkeypatch.setattr(essay_writer, "search_pool", ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(essay_writer, "SEARCH_TIMEOUT", 0.15)
+
+    with ThreadPoolExecutor(max_workers=4) as essays:
+        results = list(essays.map(lambda i: search_queries([f"essay {i} a", f"essay {i} b"]), range(4)))
+
+    assert [len(content) for content in results] == [4, 4, 4, 4]
+
+def test_asearch_queries_runs_concurrently(provide, monkeypatch):
+    provide(essay_writer.async_search_client, FakeAsyncSearchClient(latency=0.2, slow_queries={"slow query"}, snippet_words=0))
+    monkeypatch.setattr(essay_writer, "SEARCH_TIMEOUT", 0.5)
+    queries = ["first query", "slow query", "third query"]
+
+    start = time.perf_counter()
+    content = asyncio.run(asearch_queries(queries))
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < 0.8, f"Searches look sequential ({elapsed:.2f}s)"
+    assert content == [f"{q} result {i}" for q in ("first query", "third query") for i in range(2)]
+
+def test_asearch_queries_share_one_limit(provide):
+    class CountingSearchClient(FakeAsyncSearchClient):
+        active = peak = 0
+
+        async def search(self, query, max_results=5, **kwargs):
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            try:
+                return await super().search(query, max_results, **kwargs)
+            finally:
+                self.active -= 1
+
+    client = provide(essay_writer.async_search_client, CountingSearchClient(latency=0.05, snippet_words=0))
+
+    async def essays():
+        return await asyncio.gather(*(asearch_queries([f"essay {i} {q}" for q in "abc"]) for i in range(4)))
+
+    results = asyncio.run(essays())
+    assert [len(content) for content in results] == [6, 6, 6, 6]
+    assert client.peak == essay_writer.MAX_SEARCH_WORKERS
+
+def test_search_cache_hit_skips_network(provide):
+    client = FakeSearchClient(snippet_words=0)
+    provide(essay_writer.search_client, client)
+
+    first = search_queries(["Climate change"])
+    second = search_queries(["  climate CHANGE? "])
+
+    assert first == second
+    assert client.calls == 1
+    assert essay_writer.search_cache.get().stats()["hits"] == 1
+
+def test_search_cache_keeps_punctuated_queries_apart(tmp_path):
+    cache = SearchCache(str(tmp_path / "cache.db"))
+    cache.put("C++ history", 2, {"results": [{"content": "C++"}]})
+    cache.put("C# history", 2, {"results": [{"content": "C#"}]})
+
+    assert cache.get("c++ history?", 2)["results"][0]["content"] == "C++"
+    assert cache.get("C# history", 2)["results"][0]["content"] == "C#"
+    assert cache.get("C history", 2) is None
+    assert cache.stats()["entries"] == 2
+
+def test_search_cache_ttl_and_lru(tmp_path):
+    cache = SearchCache(str(tmp_path / "cache.db"), ttl_seconds=60, max_entries=2)
+    cache.put("a", 2, {"results": []})
+    cache.put("b", 2, {"results": []})
+    assert cache.get("a", 2) is not None  # "b" is now least recently used
+    cache.put("c", 2, {"results": []})
+
+    assert cache.get("b", 2) is None
+    assert cache.get("a", 2) is not None
+    assert cache.get("a", 5) is None  # max_results is part of the key
+
+    cache.ttl_seconds = -1
+    assert cache.get("c", 2) is None
+
+def test_response_cache_exact_and_similar_tiers():
+    cache = ResponseCache(max_entries=2, similarity_threshold=0.7)
+    response = AIMessage(content="An outline", usage_metadata={
+        "input_tokens": 40, "output_tokens": 60, "total_tokens": 100})
+    cache.store([SystemMessage(content="plan"), HumanMessage(content="Write an essay about climate change")], response)
+
+    exact = cache.lookup([SystemMessage(content="plan"), HumanMessage(content="Write an essay about climate change")])
+    similar = cache.lookup([SystemMessage(content="plan"), HumanMessage(content="Write an essay about the climate change")])
+    other_prompt = cache.lookup([SystemMessage(content="critique"), HumanMessage(content="Write an essay about climate change")])
+    other_topic = cache.lookup([SystemMessage(content="plan"), HumanMessage(content="Write a poem about dogs")])
+
+    assert exact is response and similar is response
+    assert other_prompt is None and other_topic is None
+    stats = cache.stats()
+    assert (stats["exact_hits"], stats["similar_hits"], stats["misses"]) == (1, 1, 2)
+    assert stats["saved_tokens"] == 200
+
+def test_build_context_dedups_ranks_and_packs():
+    snippets = [
+        "Solar panels now supply a growing share of electricity in many countries.",
+        "solar panels now supply a growing share of electricity in many countries!",
+        "Dogs were domesticated thousands of years ago.",
+        "Sea level rise threatens coastal cities through flooding and erosion.",
+    ]
+    assert len(dedup_snippets(snippets)) == 3
+
+    # A copy with a few words changed is a near-duplicate
+    words = " ".join(f"word{i}" for i in range(300)).split()
+    edited = list(words)
+    for i in (10, 150, 290):
+        edited[i] = "changed"
+    assert dedup_snippets([" ".join(words), " ".join(edited)]) == [" ".join(words)]
+
+    budget = estimate_tokens(snippets[3]) + estimate_tokens(snippets[0])
+    context = build_context(snippets, "coastal flooding from sea level rise", budget)
+
+    assert context[0] == snippets[3]
+    assert snippets[2] not in context
+    assert sum(estimate_tokens(s) for s in context) <= budget
+
+def test_instrument_attributes_calls_to_node(monkeypatch):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(metrics, "registry", registry)
+
+    def fake_node(state):
+        registry.record("searches")
+        registry.record_llm_usage(AIMessage(content="", usage_metadata={
+            "input_tokens": 12, "output_tokens": 30, "total_tokens": 42}))
+        return {}
+
+    node = instrument("planner", fake_node)
+    node({})
+    node({})
+
+    summary = registry.summary()
+    assert summary[("planner", "node_seconds")]["count"] == 2
+    assert summary[("planner", "searches")]["sum"] == 2
+    assert summary[("planner", "prompt_tokens")]["sum"] == 24
+    text = render_prometheus(summary)
+    assert 'essay_node_seconds{node="planner",quantile="0.95"}' in text
+    assert 'essay_completion_tokens_total{node="planner"} 60' in text
+
+def test_metrics_store_prunes_old_samples(tmp_path):
+    store = MetricsStore(str(tmp_path / "metrics.db"), retention_seconds=60)
+    now = time.time()
+    store.record([(now - 120, "planner", "llm_calls", 1), (now, "planner", "llm_calls", 1)])
+    assert store.get() == [("planner", "llm_calls", 1.0)]
+    store.close()
+
+    # Kept out of the chat database
+    db = ChatDatabase(str(tmp_path / "chat_history.db"))
+    tables = {row[0] for row in db._connect().execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert "node_metrics" not in tables
+    db.close()
+
+def test_essay_chain_runs_offline(offline_pipeline):
+    model, search = offline_pipeline
+    inputs = {
+        "task": "Write an essay about climate change",
+        "content": [],
+        "max_revisions": 1,
+        "revision_number": 0
+    }
+
+    result = essay_writer.get_essay_chain().invoke(inputs)
+
+    assert result["plan"] and result["draft"] and result["critique"]
+    assert result["revision_number"] == 2
+    assert inputs["content"] == []  # the reducer never mutates caller input
+    assert len(result["content"]) == search.calls * 2
+    # planner, 2x research queries, 2x writer, reflection
+    assert model.calls == 6
+
+def test_astream_essay_streams_writer_tokens(offline_pipeline):
+    async def collect():
+        return [event async for event in essay_writer.astream_essay({
+            "task": "Write an essay about climate change",
+            "content": [],
+            "max_revisions": 1,
+            "revision_number": 0
+        })]
+
+    events = asyncio.run(collect())
+
+    nodes = [event[1] for event in events if event[0] == "node"]
+    # planner and researcher_plan run in parallel, so either may finish first
+    assert set(nodes[:2]) == {"planner", "researcher_plan"}
+    assert nodes[2:] == ["writer", "reflection", "researcher_critique", "writer"]
+    assert sum(1 for event in events if event[0] == "token") > 2
+    assert events[-1][0] == "result" and events[-1][1]["draft"]
+
+def test_style_only_critique_skips_research(offline_pipeline):
+    model, _ = offline_pipeline
+    style = "Tighten the wording and improve the transitions between paragraphs."
+    assert essay_writer.critique_queries(style, []) == []
+    assert model.calls == 0
+    assert essay_writer.route_after_reflection({"critique_queries": []}) == "write"
+
+    queries = essay_writer.critique_queries("Update the figures with recent data on adoption.", [])
+    assert queries and model.calls == 1
+    assert essay_writer.route_after_reflection({"critique_queries": queries}) == "research"
+
+def test_critique_asking_only_for_searches_already_run_goes_to_writer(offline_pipeline):
+    critique = "Add more statistics on adoption."
+    previous = essay_writer.critique_queries(critique, [])
+    assert essay_writer.critique_queries(critique, previous) == []
+
+def test_critique_queries_already_run_are_skipped():
+    previous = ["climate change statistics", "history of climate policy"]
+    queries = ["Climate change statistics", "climate change effects on agriculture", "climate policy history"]
+
+    assert essay_writer.new_queries(queries, previous) == ["climate change effects on agriculture"]
+
+def test_planner_and_research_run_in_parallel(offline_pipeline):
+    model, _ = offline_pipeline
+    model.latency = 0.2
+
+    start = time.perf_counter()
+    essay_writer.get_essay_chain().invoke({
+        "task": "Write an essay about climate change",
+        "content": [],
+        "max_revisions": 0,
+        "revision_number": 0
+    })
+    elapsed = time.perf_counter() - start
+
+    # planner || research query generation, then the writer: two model
+    # round-trips on the critical path instead of three
+    assert elapsed < 0.55, f"Planner and research look sequential ({elapsed:.2f}s)"
+
+def test_batch_dedups_searches_and_resumes(offline_pipeline, tmp_path, provide):
+    _, search = offline_pipeline
+    provide(essay_writer.search_cache, None)
+    tasks_file = tmp_path / "tasks.jsonl"
+    tasks_file.write_text(
+        '{"id": "a", "task": "Write an essay about climate change"}\n'
+        '{"id": "b", "task": "Write an essay about climate change"}\n'
+        '"Write an essay about artificial intelligence"\n'
+    )
+    tasks = batch.read_tasks(str(tasks_file))
+    db = ChatDatabase(str(tmp_path / "chat_history.db"), write_behind=True)
+
+    stats = batch.run_batch(tasks[:2], db, batch_id="nightly", workers=2)
+    assert stats["completed"] == 2
+    assert stats["search_backend_calls"] < stats["search_requests"]
+    assert search.calls == stats["search_backend_calls"]
+
+    # A rerun picks up where the first one stopped
+    stats = batch.run_batch(tasks, db, batch_id="nightly", workers=2)
+    assert (stats["skipped"], stats["completed"]) == (2, 1)
+    assert db.get_completed_batch_items("nightly") == {"a", "b", "2"}
+    assert essay_writer.search_client.get() is search
+    db.close()
+
+def test_bounded_memory_checkpointer_evicts_old_threads(offline_pipeline, provide):
+    provide(essay_writer.checkpointer, BoundedMemorySaver(max_threads=2))
+    essay_writer.invalidate_essay_chain()
+    inputs = {"task": "Write an essay about tides", "content": [], "max_revisions": 0, "revision_number": 0}
+
+    for thread_id in ("one", "two", "three"):
+        essay_writer.invoke_essay(dict(inputs), thread_id=thread_id)
+
+    chain = essay_writer.get_essay_chain(checkpointed=True)
+    assert not chain.get_state(essay_writer.essay_config("one")).values
+    assert chain.get_state(essay_writer.essay_config("three")).values["draft"]
+
+def test_resuming_a_finished_thread_returns_it(offline_pipeline, provide):
+    model, _ = offline_pipeline
+    provide(essay_writer.checkpointer, BoundedMemorySaver())
+    essay_writer.invalidate_essay_chain()
+    inputs = {"task": "Write an essay about tides", "content": [], "max_revisions": 1, "revision_number": 0}
+
+    first = essay_writer.invoke_essay(dict(inputs), thread_id="done", resume=True)
+    calls = model.calls
+    again = essay_writer.invoke_essay(dict(inputs), thread_id="done", resume=True)
+
+    assert model.calls == calls
+    assert again["content"] == first["content"] and again["queries"] == first["queries"]
+
+def test_runs_without_thread_id_are_not_checkpointed(offline_pipeline, provide):
+    saver = provide(essay_writer.checkpointer, BoundedMemorySaver())
+    essay_writer.invalidate_essay_chain()
+    inputs = {"task": "Write an essay about tides", "content": [], "max_revisions": 0, "revision_number": 0}
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        essay_writer.invoke_essay(dict(inputs))
+        list(essay_writer.stream_essay(dict(inputs, task="Write an essay about rivers")))
+    assert not list(saver.list(None))
+
+    essay_writer.invoke_essay(dict(inputs), thread_id="named")
+    assert len({c.config["configurable"]["thread_id"] for c in saver.list(None)}) == 1
+
+def test_import_is_lazy():
+    # No API keys needed and no heavy client libraries loaded at import
+    env = {k: v for k, v in os.environ.items() if k not in ("OPENAI_API_KEY", "TAVILY_API_KEY")}
+    code = (
+        "import sys, essay_writer; "
+        "print(sorted(m for m in ('langgraph', 'langchain_openai', 'tavily') if m in sys.modules))"
+    )
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "[]"
+
+def test_concurrent_opens_migrate_once(tmp_path):
+    # Like app.py and batch.py starting together on a fresh database
+    path = str(tmp_path / "chat_history.db")
+    start = threading.Barrier(8)
+    def open_db(_):
+        start.wait()
+        ChatDatabase(path).close()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(open_db, range(8)))
+
+    db = ChatDatabase(path)
+    assert db._connect().execute('PRAGMA user_version').fetchone()[0] == len(chat_db.MIGRATIONS)
+    db.close()
+
+def test_recent_summaries_cache_tracks_saves(tmp_path):
+    db = ChatDatabase(str(tmp_path / "chat_history.db"), write_behind=True)
+    state = {"task": "Tides", "plan": "p", "draft": "d", "critique": "c", "content": [], "revision_number": 2}
+    db.save_conversation("u1", state)
+    assert [s["task"] for s in db.get_recent_summaries("u1")] == ["Tides"]
+
+    # Cached from here on, and kept current by the write-behind saves
+    for task in ("Rivers", "Lakes"):
+        db.enqueue_conversation("u1", dict(state, task=task))
+    db.flush()
+    recent = db.get_recent_summaries("u1", limit=2)
+    assert [s["task"] for s in recent] == ["Lakes", "Rivers"]
+    assert recent[0]["summary"] == "Essay about: Lakes (Revision 2)"
+
+    db.summaries.clear()
+    assert db.get_recent_summaries("u1", limit=2) == recent
+    db.close()
+
+def test_get_conversation_keeps_multiline_snippets(tmp_path):
+    state = {"task": "Tides", "plan": "p", "draft": "d", "critique": "c", "revision_number": 1,
+             "content": ["First snippet\nwith a second line", "Second snippet"]}
+    for compact in (False, True):
+        db = ChatDatabase(str(tmp_path / f"compact-{compact}.db"), compact=compact)
+        conversation = db.get_conversation(db.save_conversation("u1", state))
+        # Plain rows cannot be split back into snippets
+        expected = state["content"] if compact else ["\n".join(state["content"])]
+        assert conversation["content"] == expected
+        db.close()
+
+def test_write_behind_flush_is_immediate_and_raises_failures(tmp_path, monkeypatch):
+    db = ChatDatabase(str(tmp_path / "chat_history.db"), write_behind=True, flush_interval=30)
+    state = {"task": "Tides", "plan": "p", "draft": "d", "critique": "c", "content": [], "revision_number": 1}
+    start = time.perf_counter()
+    db.enqueue_conversation("u1", state)
+    db.flush()
+    assert time.perf_counter() - start < 5
+    assert [s["task"] for s in db.get_recent_summaries("u1")] == ["Tides"]
+
+    def fail(*args, **kwargs):
+        raise sqlite3.OperationalError("disk I/O error")
+    monkeypatch.setattr(db, "save_conversations", fail)
+    db.enqueue_conversation("u1", dict(state, task="Rivers"), ("nightly", "a"))
+    with pytest.raises(chat_db.WriteBehindError) as error:
+        db.flush()
+    assert [item for _, _, item in error.value.items] == [("nightly", "a")]
+    # Reported once
+    db.flush()
+    db.close()
+
+def test_identical_requests_share_one_run(offline_pipeline, tmp_path, monkeypatch):
+    model, _ = offline_pipeline
+    model.latency = 0.05
+    monkeypatch.setattr(essay_writer, "response_cache", None)
+    inputs = {"task": "Write an essay about climate change", "content": [], "max_revisions": 1, "revision_number": 0}
+    essay_writer.invoke_essay(dict(inputs, task="Write an essay about tides"))
+    calls_per_run = model.calls
+
+    users = [f"user-{i}" for i in range(5)]
+    start = threading.Barrier(len(users))
+    def request(i):
+        start.wait()
+        # Differs only in case and spacing
+        task = inputs["task"].upper() if i % 2 else f"  {inputs['task']} "
+        return essay_writer.invoke_essay(dict(inputs, task=task))
+
+    with ThreadPoolExecutor(max_workers=len(users)) as pool:
+        results = list(pool.map(request, range(len(users))))
+    assert model.calls == 2 * calls_per_run
+    assert essay_writer.essay_flights.joined >= len(users) - 1
+
+    # Streaming callers each get every event of the shared run
+    async def stream():
+        async def one():
+            return [event async for event in essay_writer.astream_essay(dict(inputs))]
+        return await asyncio.gather(*(one() for _ in users))
+    streams = asyncio.run(stream())
+    assert model.calls == 3 * calls_per_run
+    assert all(events == streams[0] and events[-1][0] == "result" for events in streams)
+
+    # ...and each is still saved for its own user
+    db = ChatDatabase(str(tmp_path / "chat_history.db"))
+    for user_id, result in zip(users, results):
+        db.create_or_get_user(user_id, user_id)
+        db.enqueue_conversation(user_id, result)
+    assert all(len(db.get_recent_summaries(user_id)) == 1 for user_id in users)
+    db.close()
+
+@pytest.fixture
+def flaky_server():
+    # Local search endpoint that answers with the queued error statuses
+    # first (429s carry Retry-After: retry_after), then succeeds
+    class Handler(BaseHTTPRequestHandler):
+        failures = []
+        requests = 0
+        retry_after = "0"
+
+        def do_GET(self):
+            Handler.requests += 1
+            status = Handler.failures.pop(0) if Handler.failures else 200
+            body = json.dumps({"results": [{"content": f"result for {self.path}"}]}).encode()
+            self.send_response(status)
+            if status == 429:
+                self.send_header("Retry-After", Handler.retry_after)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}", Handler
+    server.shutdown()
+    server.server_close()
+
+class HTTPSearchClient:
+    def __init__(self, url):
+        self.url = url
+
+    def search(self, query, max_results=2):
+        with urllib.request.urlopen(f"{self.url}/search?q={len(query)}", timeout=5) as response:
+            return json.load(response)
+
+def test_search_retries_429s_from_server(flaky_server, provide, monkeypatch):
+    url, handler = flaky_server
+    handler.failures = [429, 429, 503]
+    provide(essay_writer.search_client, HTTPSearchClient(url))
+    monkeypatch.setattr(essay_writer.tavily_limiter, "base_delay", 0.01)
+    retries = metrics.registry.summary().get(("-", "retries"), {}).get("count", 0)
+
+    content = search_queries(["retried query"])
+
+    assert content == ["result for /search?q=13"]
+    assert handler.requests == 4
+    assert metrics.registry.summary()[("-", "retries")]["count"] == retries + 3
+
+def test_tavily_usage_limit_is_retried(flaky_server, provide, monkeypatch):
+    tavily = pytest.importorskip("tavily")
+    url, handler = flaky_server
+    handler.failures = [429]
+    client = tavily.TavilyClient(api_key="tvly-test")
+    client.base_url = url
+    provide(essay_writer.search_client, client)
+    monkeypatch.setattr(essay_writer.tavily_limiter, "base_delay", 0.01)
+
+    assert search_queries(["retried query"]) == ["result for /search"]
+    assert handler.requests == 2
+
+def test_search_deadline_stops_limiter_retries(flaky_server, provide, monkeypatch):
+    # A Retry-After longer than the search timeout drops the query at once
+    # instead of sleeping, and nothing is retried after it is dropped
+    url, handler = flaky_server
+    handler.failures = [429]
+    handler.retry_after = "30"
+    provide(essay_writer.search_client, HTTPSearchClient(url))
+    monkeypatch.setattr(essay_writer, "SEARCH_TIMEOUT", 1)
+    monkeypatch.setattr(essay_writer.tavily_limiter, "_blocked_until", 0.0)
+
+    start = time.perf_counter()
+    assert search_queries(["throttled query"]) == []
+    assert time.perf_counter() - start < 1
+    time.sleep(0.2)
+    assert handler.requests == 1
+
+def test_node_retry_skips_errors_the_limiter_gave_up_on(flaky_server):
+    url, handler = flaky_server
+    handler.failures = [503, 503]
+    limiter = RateLimiter("test", max_attempts=2, base_delay=0.01)
+
+    with pytest.raises(urllib.error.HTTPError) as error:
+        limiter.call(HTTPSearchClient(url).search, "query")
+    assert handler.requests == 2
+    assert is_retryable(error.value)
+    assert not essay_writer.should_retry_node(error.value)
+
+def test_non_retryable_error_is_raised_at_once(flaky_server):
+    url, handler = flaky_server
+    handler.failures = [400]
+    limiter = RateLimiter("test", base_delay=0.01)
+
+    with pytest.raises(urllib.error.HTTPError):
+        limiter.call(HTTPSearchClient(url).search, "query")
+    assert handler.requests == 1
+
+def test_rate_limiter_keeps_headroom_for_interactive_calls():
+    # 600/min refills 10 per second, with 100 (10s) of burst
+    limiter = RateLimiter("test", requests_per_minute=600, batch_reserve=0.2)
+    assert all(limiter.reserve() == 0 for _ in range(80))
+
+    # Batch work must leave 20% of the burst, interactive work may use it
+    with priority(BATCH):
+        assert limiter.reserve() == pytest.approx(0.1, abs=0.02)
+    assert limiter.reserve() == 0
+
+    for _ in range(18):
+        limiter.reserve()
+    assert limiter.reserve() == pytest.approx(0.1, abs=0.02)
+
+def offline_worker():
+    # EssayWorkerPool setup: fakes in place of the real clients
+    essay_writer.chat_model.set(FakeChatModel())
+    essay_writer.search_client.set(FakeSearchClient(snippet_words=0))
+    essay_writer.search_cache.set(None)
+    essay_writer.checkpointer.set(None)
+
+def test_worker_pool_streams_essay(tmp_path):
+    pool = EssayWorkerPool(2, str(tmp_path / "metrics.db"), setup=offline_worker)
+    inputs = {"task": "Write an essay about rivers", "content": [], "max_revisions": 1, "revision_number": 0}
+
+    async def run(n):
+        async def one():
+            return [event async for event in pool.astream_essay(dict(inputs))]
+        return await asyncio.gather(*(one() for _ in range(n)))
+
+    try:
+        assert len(pool.warm()) == 2
+        runs = asyncio.run(run(3))
+    finally:
+        pool.close()
+
+    for events in runs:
+        assert any(event[0] == "token" for event in events)
+        assert events[-1][0] == "result"
+        assert events[-1][1]["draft"]
+
+def slow_offline_worker():
+    offline_worker()
+    essay_writer.chat_model.set(FakeChatModel(latency=0.3))
+
+def test_worker_pool_relays_events_off_the_default_executor(tmp_path):
+    # Essays waiting on their workers must not hold the threads app.py's
+    # asyncio.to_thread database calls run on
+    pool = EssayWorkerPool(1, str(tmp_path / "metrics.db"), setup=slow_offline_worker)
+
+    async def run():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=1))
+        essays = [asyncio.ensure_future(consume(f"Write an essay about rivers {i}")) for i in range(3)]
+        await asyncio.sleep(0.2)
+        start = time.perf_counter()
+        await asyncio.to_thread(lambda: None)
+        waited = time.perf_counter() - start
+        await asyncio.gather(*essays)
+        return waited
+
+    async def consume(task):
+        inputs = {"task": task, "content": [], "max_revisions": 0, "revision_number": 0}
+        return [event async for event in pool.astream_essay(inputs)]
+
+    try:
+        pool.warm()
+        assert asyncio.run(run()) < 0.1
+    finally:
+        pool.close()
+
 if __name__ == "__main__":
     test_research_critique_node()